@@ -0,0 +1,228 @@
+"""End-to-end throughput benchmark of the ingest consumer
+
+Uploads synthetic objects to an in-process moto S3 server, then feeds the
+matching bucket notifications to the consumer through an in-memory stand-in
+for the AMQP channel. The restapi is replaced by a stub unless --no-restapi
+is given, and the converter by stub_convert.py unless --converter is.
+Reports files/s, bytes/s and the time spent in each stage as JSON.
+
+Usage (from the ingest directory):
+
+    python -m benchmarks.run --files 100 --sizes 1048576 67108864
+"""
+
+import argparse
+import asyncio
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import socket
+import sys
+import time
+from typing import AsyncIterator
+
+from moto.server import ThreadedMotoServer
+
+INBOX = "transfer-inbox"
+STUB_CONVERTER = os.path.join(os.path.dirname(__file__), "stub_convert.py")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class InMemoryExchange:
+    def __init__(self):
+        self.published: list[tuple[str, object]] = []
+
+    async def publish(self, message, routing_key: str):
+        self.published.append((routing_key, message))
+
+
+class InMemoryChannel:
+    """Just enough of a channel for the consumer's retry and dead-letter path"""
+
+    def __init__(self):
+        self.default_exchange = InMemoryExchange()
+
+
+class InMemoryMessage:
+    def __init__(self, body: bytes, routing_key: str):
+        self.body = body
+        self.routing_key = routing_key
+        self.headers: dict = {}
+        self.content_type = "application/json"
+        self.message_id: str | None = None
+        self.acked = asyncio.Event()
+
+    async def ack(self):
+        self.acked.set()
+
+
+def synthetic_object(size: int, seed: int) -> AsyncIterator[bytes]:
+    """ROOT-like content: the file magic followed by incompressible bytes"""
+    block = hashlib.sha256(str(seed).encode()).digest() * (1024 * 1024 // 32)
+
+    async def chunks():
+        remaining = size
+        head = b"root\x00\x00\xf8\x42"
+        while remaining > 0:
+            chunk = (head + block)[:remaining]
+            head = b""
+            remaining -= len(chunk)
+            yield chunk
+
+    return chunks()
+
+
+def notification(key: str, size: int, etag: str, sequence: int) -> bytes:
+    record = {
+        "eventVersion": "2.2",
+        "eventTime": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+        "eventName": "ObjectCreated:Put",
+        "userIdentity": {"principalId": "benchmark"},
+        "s3": {
+            "s3SchemaVersion": "1.0",
+            "configurationId": "benchmark",
+            "bucket": {"name": INBOX, "ownerIdentity": {"principalId": "benchmark"}},
+            "object": {
+                "key": key,
+                "size": size,
+                "eTag": etag,
+                "sequencer": f"{sequence:016X}",
+            },
+        },
+    }
+    return json.dumps({"Records": [record]}).encode()
+
+
+async def upload_objects(sizes: list[int], count: int) -> list[bytes]:
+    from consumer.shared import s3util
+
+    bodies = []
+    async with s3util.get_client("s3") as client:
+        await s3util.create_bucket(client, INBOX, "default")
+        for i, size in zip(range(count), itertools.cycle(sizes)):
+            key = f"benchmark/file{i:06d}.root"
+            etag = await s3util.upload_multipart(
+                client, INBOX, key, synthetic_object(size, i)
+            )
+            bodies.append(notification(key, size, etag, i))
+    return bodies
+
+
+async def consume(bodies: list[bytes], args) -> dict:
+    from consumer.main import Context, receive
+    from consumer.restapi import RestAPIClient
+    from consumer.scheduler import Scheduler
+    from consumer.spool import Spool
+
+    restapi = None
+    if args.restapi_url:
+        restapi = RestAPIClient(args.restapi_url, "benchmark", "benchmark", "benchmark")
+    channel = InMemoryChannel()
+    context = Context(
+        channel=channel,  # type: ignore[arg-type]
+        queue_name="benchmark",
+        scheduler=Scheduler.from_environ(),
+        retry_delays=[],
+        cache=None,
+        restapi=restapi,
+        spool=Spool.from_environ(),
+    )
+    messages = [InMemoryMessage(body, "bucket.transfer-notifier") for body in bodies]
+    # prefetch bounds the unacknowledged messages, as the broker would
+    prefetch = asyncio.Semaphore(args.prefetch or len(messages))
+
+    async def deliver(message: InMemoryMessage):
+        async with prefetch:
+            await receive(message, context)  # type: ignore[arg-type]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(deliver(message) for message in messages))
+    elapsed = time.perf_counter() - start
+    if restapi:
+        await restapi.close()
+
+    total_bytes = sum(
+        json.loads(body)["Records"][0]["s3"]["object"]["size"] for body in bodies
+    )
+    return {
+        "files": len(bodies),
+        "bytes": total_bytes,
+        "failed": len(channel.default_exchange.published),
+        "elapsed_s": elapsed,
+        "files_per_s": len(bodies) / elapsed,
+        "bytes_per_s": total_bytes / elapsed,
+        "stages": context.timings.summary(),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1024 * 1024],
+        help="Object sizes in bytes, cycled through",
+    )
+    parser.add_argument(
+        "--prefetch", type=int, default=0, help="As AMQP_PREFETCH, 0 for unbounded"
+    )
+    parser.add_argument("--mode", choices=["full", "metadata"], default="full")
+    parser.add_argument(
+        "--converter",
+        default=f"{sys.executable} {STUB_CONVERTER}",
+        help="Converter command, e.g. 'python3 convert.py' with ROOT installed",
+    )
+    parser.add_argument("--no-restapi", action="store_true")
+    parser.add_argument("--output", default="ingest-benchmark.json")
+    args = parser.parse_args()
+
+    s3 = ThreadedMotoServer(ip_address="127.0.0.1", port=free_port(), verbose=False)
+    s3.start()
+    _, s3_port = s3.get_host_and_port()
+    os.environ |= {
+        "S3_ENDPOINT": f"http://127.0.0.1:{s3_port}",
+        "S3_ACCESS_KEY": "benchmark",
+        "S3_SECRET_KEY": "benchmark",
+        "INGEST_MODE": args.mode,
+        "INGEST_CONVERTER": args.converter,
+    }
+    args.restapi_url = None
+    if not args.no_restapi:
+        from . import stub_restapi
+
+        port = free_port()
+        restapi_server = stub_restapi.serve(port)
+        args.restapi_url = f"http://127.0.0.1:{port}"
+
+    try:
+        bodies = asyncio.run(upload_objects(args.sizes, args.files))
+        result = asyncio.run(consume(bodies, args))
+    finally:
+        if not args.no_restapi:
+            restapi_server.should_exit = True
+        s3.stop()
+
+    result["config"] = {
+        "sizes": args.sizes,
+        "prefetch": args.prefetch,
+        "mode": args.mode,
+        "converter": args.converter,
+        "restapi": not args.no_restapi,
+    }
+    print(json.dumps(result, indent=2))
+    with open(args.output, "w") as fout:
+        json.dump(result, fout, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
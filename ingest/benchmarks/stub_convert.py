@@ -0,0 +1,31 @@
+"""Stand-in for convert.py that needs no ROOT installation
+
+Reads the whole input (unless --metadata-only) and prints key listings in
+the format of convert.py, so the consumer does comparable I/O
+"""
+
+import argparse
+import json
+import urllib.request
+
+parser = argparse.ArgumentParser()
+parser.add_argument("input")
+parser.add_argument("--metadata-only", action="store_true")
+parser.add_argument("--keys", type=int, default=10)
+args, _ = parser.parse_known_args()
+
+size = 0
+if not args.metadata_only:
+    if args.input.startswith(("http://", "https://")):
+        fin = urllib.request.urlopen(args.input)
+    else:
+        fin = open(args.input, "rb")
+    with fin:
+        while chunk := fin.read(1024 * 1024):
+            size += len(chunk)
+
+for index in range(args.keys):
+    msg = {"index": index, "key": f"tree{index}", "class": "TTree"}
+    if not args.metadata_only:
+        msg |= {"entries": 1000, "bytes": size // args.keys}
+    print(json.dumps(msg), flush=True)
@@ -0,0 +1,36 @@
+"""Stand-in for the restapi endpoints the consumer calls"""
+
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+app = FastAPI()
+
+
+@app.post("/auth/token")
+async def token():
+    return {"access_token": "benchmark", "token_type": "bearer"}
+
+
+@app.put("/files/{bucket}/{key:path}")
+async def register_file(bucket: str, key: str, request: Request):
+    return await request.json()
+
+
+@app.post("/items/stream")
+async def stream_items(request: Request):
+    inserted = 0
+    async for chunk in request.stream():
+        inserted += chunk.count(b"\n")
+    return {"inserted": inserted, "failed": 0, "errors": []}
+
+
+def serve(port: int) -> uvicorn.Server:
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
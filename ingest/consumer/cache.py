@@ -0,0 +1,123 @@
+import datetime
+import hashlib
+import logging
+import os
+import time
+from typing import TYPE_CHECKING
+
+from botocore.exceptions import ClientError
+
+from .message import AWSRecord
+from .shared import s3util
+
+if TYPE_CHECKING:
+    from types_aiobotocore_s3.client import S3Client
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Converter results stored in S3, keyed by object eTag and size
+
+    Results live under results/<mode>/<eTag>-<size>.jsonl in the cache bucket.
+    Which version, and so which result, a key maps to is recorded in the
+    restapi's file catalog. A hit rewrites the result's metadata in place to refresh its LastModified
+    time, so evicting the least recently modified results first is an LRU
+    bounded by max_bytes.
+    """
+
+    def __init__(self, bucket: str, max_bytes: int, evict_interval: float = 300.0):
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self._last_eviction = 0.0
+
+    @classmethod
+    def from_environ(cls) -> "ResultCache | None":
+        bucket = os.environ.get("INGEST_CACHE_BUCKET")
+        if bucket is None:
+            return None
+        return cls(
+            bucket=bucket,
+            max_bytes=int(os.environ.get("INGEST_CACHE_MAX_BYTES", str(10 * 1024**3))),
+            evict_interval=float(os.environ.get("INGEST_CACHE_EVICT_INTERVAL", "300")),
+        )
+
+    @staticmethod
+    def mode_for(mode: str, options: list[str]) -> str:
+        """Mode to cache results of mode under, distinct per output options"""
+        if not options:
+            return mode
+        return f"{mode}-{hashlib.sha256(' '.join(options).encode()).hexdigest()[:8]}"
+
+    async def setup(self, client: "S3Client"):
+        await s3util.create_bucket(client, self.bucket)
+        # earlier versions wrote links/<bucket>/<key> objects, never evicted
+        paginator = client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix="links/"):
+            if objects := [{"Key": obj["Key"]} for obj in page.get("Contents", [])]:
+                await client.delete_objects(
+                    Bucket=self.bucket, Delete={"Objects": objects}
+                )
+
+    def _result_key(self, event: AWSRecord, mode: str) -> str:
+        etag = event.s3.object.eTag.strip('"')
+        return f"results/{mode}/{etag}-{event.s3.object.size}.jsonl"
+
+    async def get(
+        self, client: "S3Client", event: AWSRecord, mode: str
+    ) -> list[str] | None:
+        """Return the cached converter output lines, or None on a miss"""
+        result_key = self._result_key(event, mode)
+        try:
+            result = await client.get_object(Bucket=self.bucket, Key=result_key)
+            body = await result["Body"].read()
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        await client.copy_object(
+            Bucket=self.bucket,
+            Key=result_key,
+            CopySource={"Bucket": self.bucket, "Key": result_key},
+            Metadata={
+                "last-access": datetime.datetime.now(datetime.timezone.utc).isoformat()
+            },
+            MetadataDirective="REPLACE",
+        )
+        logger.info(f"Cache hit for {event.s3.object.key}: {result_key}")
+        return body.decode().splitlines()
+
+    async def put(
+        self, client: "S3Client", event: AWSRecord, mode: str, lines: list[str]
+    ):
+        result_key = self._result_key(event, mode)
+        await client.put_object(
+            Bucket=self.bucket,
+            Key=result_key,
+            Body="".join(line + "\n" for line in lines).encode(),
+        )
+        if time.monotonic() - self._last_eviction > self.evict_interval:
+            self._last_eviction = time.monotonic()
+            await self.evict(client)
+
+    async def evict(self, client: "S3Client"):
+        """Delete least recently used results until the cache fits in max_bytes"""
+        results = []
+        paginator = client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix="results/"):
+            for obj in page.get("Contents", []):
+                results.append((obj["LastModified"], obj["Size"], obj["Key"]))
+        total = sum(size for _, size, _ in results)
+        results.sort()
+        evicted = []
+        while total > self.max_bytes and results:
+            _, size, key = results.pop(0)
+            evicted.append({"Key": key})
+            total -= size
+        # delete_objects takes at most 1000 keys per request
+        for start in range(0, len(evicted), 1000):
+            await client.delete_objects(
+                Bucket=self.bucket, Delete={"Objects": evicted[start : start + 1000]}
+            )
+        logger.info(f"Evicted {len(evicted)} cached results, {total} bytes remain")
@@ -1,68 +1,302 @@
 import logging
 import asyncio
+import dataclasses
 import tempfile
 import os
+import shlex
+import signal
+import time
+from typing import Awaitable, BinaryIO, Callable
 
+import httpx
 from aio_pika import ExchangeType, connect_robust
-from aio_pika.abc import AbstractIncomingMessage
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage, AbstractQueue
 from pydantic import ValidationError
 
+from .cache import ResultCache
 from .message import AWSEvent, AWSRecord
-from .shared import s3util
+from .restapi import RestAPIClient, parse_keys
+from .scheduler import Scheduler
+from .sharding import KeyLocks
+from .spool import Spool
+from . import sharding
+from .shared import amqputil, s3util
+from .timing import StageTimings
 
 logger = logging.getLogger(__name__)
 
 
-async def process(event: AWSRecord):
-    # TODO: restapi call to register new file and record start of conversion
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tmpfile = os.path.join(tmpdir, "input.root")
-        logger.info(f"Temporary file: {tmpfile}")
-        async with s3util.get_client("s3") as client:
-            result = await client.get_object(
-                Bucket="transfer-inbox", Key=event.s3.object.key
-            )
-            body = result["Body"]
-            with open(tmpfile, "wb") as fout:
-                logger.info("Starting download")
-                async for chunk in body.iter_chunks(chunk_size=32 * 1024):  # type: ignore[attr-defined]
-                    fout.write(chunk)
-                logger.info("Finished download")
-        proc = await asyncio.create_subprocess_exec(
-            "python3",
-            "convert.py",
-            tmpfile,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+# "full" downloads each object before conversion, "metadata" only lists
+# the keys, reading the parts of the file it needs with ranged requests
+INGEST_MODE = os.environ.get("INGEST_MODE", "full")
+if INGEST_MODE not in ("full", "metadata"):
+    raise RuntimeError(f"Unsupported INGEST_MODE: {INGEST_MODE!r}")
+# Read every tree entry, which decompresses the whole file, rather than
+# only listing the keys
+INGEST_READ_ENTRIES = os.environ.get("INGEST_READ_ENTRIES", "false").lower() == "true"
+# Converter worker processes per file when reading entries, 0 for one per
+# available CPU
+INGEST_CONVERT_JOBS = os.environ.get("INGEST_CONVERT_JOBS", "1")
+# Options of full conversions that change the converter output
+OUTPUT_OPTIONS = ["--read-entries"] if INGEST_READ_ENTRIES else []
+# Options for full conversions
+CONVERT_OPTIONS = ["--jobs", INGEST_CONVERT_JOBS] + OUTPUT_OPTIONS
+# Cached results are only reused for the same output
+CACHE_MODE = ResultCache.mode_for(
+    INGEST_MODE, OUTPUT_OPTIONS if INGEST_MODE == "full" else []
+)
+# Command the input and options are appended to
+INGEST_CONVERTER = shlex.split(os.environ.get("INGEST_CONVERTER", "python3 convert.py"))
+# Objects up to this size are downloaded into memory rather than to disk,
+# 0 to disable. They count against the memory limit, see the lane budgets
+INGEST_MEMORY_THRESHOLD = int(os.environ.get("INGEST_MEMORY_THRESHOLD", "0"))
+# Seconds in-flight messages get to finish on SIGTERM before they are
+# cancelled (checkpointing their downloads) and left to be redelivered
+INGEST_SHUTDOWN_GRACE = float(os.environ.get("INGEST_SHUTDOWN_GRACE", "20"))
+
+
+async def download(event: AWSRecord, fout: BinaryIO):
+    async with s3util.get_client("s3") as client:
+        result = await client.get_object(
+            Bucket="transfer-inbox", Key=event.s3.object.key
         )
-        assert proc.stdout
-        logger.info("Starting conversion process")
+        body = result["Body"]
+        logger.info("Starting download")
+        async for chunk in body.iter_chunks(chunk_size=32 * 1024):  # type: ignore[attr-defined]
+            fout.write(chunk)
+        logger.info("Finished download")
+
+
+async def download_to_memory(event: AWSRecord) -> int:
+    """Download an object into an anonymous in-memory file
+
+    Returns its file descriptor, which the caller closes
+    """
+    # the name is only for debugging and limited to 249 bytes, keys may not fit
+    fd = os.memfd_create("ingest")
+    try:
+        with open(fd, "wb", closefd=False) as fout:
+            await download(event, fout)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+async def _discard(line: str):
+    pass
+
+
+async def convert(
+    source: str,
+    *options: str,
+    on_line: Callable[[str], Awaitable[None]] = _discard,
+    pass_fds: tuple[int, ...] = (),
+) -> list[str]:
+    """Run the converter on a local path or URL
+
+    on_line is called with each output line as soon as it is produced
+    pass_fds are inherited by the converter, e.g. for a /proc/self/fd source
+    Returns the lines it printed
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *INGEST_CONVERTER,
+        source,
+        *options,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        pass_fds=pass_fds,
+    )
+    assert proc.stdout
+    logger.info("Starting conversion process")
+    lines = []
+    try:
         while line := await proc.stdout.readline():
-            print(line.rstrip().decode())
+            lines.append(line.rstrip().decode())
+            print(lines[-1])
+            await on_line(lines[-1])
         stdout, stderr = await proc.communicate()
-        print(f"[root exited with {proc.returncode}]")
-        if stdout:
-            print(f"[stdout]\n{stdout.decode()}")
-        if stderr:
-            print(f"[stderr]\n{stderr.decode()}")
+    finally:
+        # e.g. cancelled at shutdown
+        if proc.returncode is None:
+            proc.kill()
+    print(f"[root exited with {proc.returncode}]")
+    if stdout:
+        print(f"[stdout]\n{stdout.decode()}")
+    if stderr:
+        print(f"[stderr]\n{stderr.decode()}")
+    if proc.returncode != 0:
+        raise RuntimeError(f"Converter exited with {proc.returncode}")
+    return lines
+
+
+@dataclasses.dataclass
+class Context:
+    channel: AbstractChannel
+    queue_name: str
+    scheduler: Scheduler
+    retry_delays: list[int]
+    cache: ResultCache | None
+    restapi: RestAPIClient | None
+    spool: Spool | None = None
+    timings: StageTimings = dataclasses.field(default_factory=StageTimings)
+    key_locks: KeyLocks = dataclasses.field(default_factory=KeyLocks)
+
+
+async def convert_object(
+    event: AWSRecord,
+    context: Context,
+    on_line: Callable[[str], Awaitable[None]] = _discard,
+) -> list[str]:
+    if context.cache:
+        async with s3util.get_client("s3") as client:
+            lines = await context.cache.get(client, event, CACHE_MODE)
+        if lines is not None:
+            for line in lines:
+                print(line)
+                await on_line(line)
+            return lines
+
+    if INGEST_MODE == "metadata":
+        # ROOT opens the URL itself and only fetches the header and key list
+        async with s3util.get_client("s3") as client:
+            url = await s3util.presign_object(
+                client, "transfer-inbox", event.s3.object.key, "get"
+            )
+        with context.timings.measure("convert"):
+            lines = await convert(url, "--metadata-only", on_line=on_line)
+    elif INGEST_MEMORY_THRESHOLD and event.s3.object.size <= INGEST_MEMORY_THRESHOLD:
+        with context.timings.measure("download"):
+            fd = await download_to_memory(event)
+        try:
+            # the converter inherits the descriptor under the same number
+            with context.timings.measure("convert"):
+                lines = await convert(
+                    f"/proc/self/fd/{fd}",
+                    *CONVERT_OPTIONS,
+                    on_line=on_line,
+                    pass_fds=(fd,),
+                )
+        finally:
+            os.close(fd)
+    elif context.spool:
+        # partial downloads are resumed if the event is retried or redelivered
+        obj = event.s3.object
+        with context.timings.measure("download"):
+            path = await context.spool.download(
+                "transfer-inbox", obj.key, obj.eTag, obj.size
+            )
+        try:
+            with context.timings.measure("convert"):
+                lines = await convert(path, *CONVERT_OPTIONS, on_line=on_line)
+        except BaseException:
+            context.spool.release("transfer-inbox", obj.key, obj.eTag, keep=True)
+            raise
+        context.spool.release("transfer-inbox", obj.key, obj.eTag)
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpfile = os.path.join(tmpdir, "input.root")
+            logger.info(f"Temporary file: {tmpfile}")
+            with context.timings.measure("download"), open(tmpfile, "wb") as fout:
+                await download(event, fout)
+            with context.timings.measure("convert"):
+                lines = await convert(tmpfile, *CONVERT_OPTIONS, on_line=on_line)
+
+    if context.cache:
+        async with s3util.get_client("s3") as client:
+            await context.cache.put(client, event, CACHE_MODE, lines)
+    return lines
 
-    # TODO: restapi call to declare conversion (partially?) finished
+
+async def process(event: AWSRecord, context: Context):
+    if not context.restapi:
+        await convert_object(event, context)
+        return
+    with context.timings.measure("register"):
+        await context.restapi.register_file(event, "converting")
+    try:
+        async with context.restapi.stream_items(event) as send:
+            lines = await convert_object(event, context, on_line=send)
+            converted = time.perf_counter()
+        # items are sent while converting, only the final flush is counted
+        context.timings.record("register", time.perf_counter() - converted)
+    except Exception:
+        try:
+            await context.restapi.register_file(event, "failed")
+        except httpx.HTTPError as ex:
+            logger.error(f"Failed to record conversion failure: {ex}")
+        raise
+    with context.timings.measure("register"):
+        await context.restapi.register_file(event, "done", parse_keys(lines))
 
 
-async def receive(message: AbstractIncomingMessage):
-    assert message.routing_key == "bucket.transfer-notifier"
+async def parse_event(
+    message: AbstractIncomingMessage, context: Context
+) -> AWSRecord | None:
+    """The record in a notification, or None if it was dead-lettered"""
     try:
         data = AWSEvent.model_validate_json(message.body)
         if len(data.Records) != 1:
             raise ValueError(f"More than one record")
-        event = data.Records[0]
     except (ValueError, ValidationError) as ex:
         logger.error(f"Failed to parse incoming message {message}: {ex}")
-        return await message.reject(requeue=False)
+        await amqputil.dead_letter(
+            context.channel, context.queue_name, message, str(ex)
+        )
+        return None
     logger.debug(f" [x] {message.routing_key}:{data}")
-    async with message.process(requeue=True):
-        await process(event)
+    return data.Records[0]
+
+
+async def dispatch(message: AbstractIncomingMessage, context: Context, shards: int):
+    """Forward a notification to the shard queue of its object key"""
+    event = await parse_event(message, context)
+    if event is not None:
+        shard = sharding.shard_for(event.s3.bucket.name, event.s3.object.key, shards)
+        await amqputil.forward(
+            context.channel,
+            sharding.shard_queue_name(context.queue_name, shard),
+            message,
+        )
+    await message.ack()
+
+
+async def receive(message: AbstractIncomingMessage, context: Context):
+    assert message.routing_key == "bucket.transfer-notifier" or (
+        message.routing_key.startswith(f"{context.queue_name}.shard.")
+    )
+    event = await parse_event(message, context)
+    if event is None:
+        return await message.ack()
+    size = event.s3.object.size
+    lane = context.scheduler.lane_for(size)
+    # Events for the same key are processed one at a time, in arrival order
+    async with context.key_locks.hold(
+        f"{event.s3.bucket.name}/{event.s3.object.key}"
+    ), lane.admit(size):
+        logger.info(
+            f"Admitted {event.s3.object.key} ({size} bytes) to {lane.name} lane"
+        )
+        try:
+            await process(event, context)
+        except Exception as ex:
+            logger.exception(f"Failed to process {event.s3.object.key}")
+            # Failed messages go through a delay queue rather than being
+            # requeued immediately, and are dead-lettered after the last retry
+            try:
+                await amqputil.retry_or_dead_letter(
+                    context.channel,
+                    context.queue_name,
+                    message,
+                    repr(ex),
+                    context.retry_delays,
+                )
+            except Exception:
+                # not republished, so it must not be acked either
+                logger.exception(f"Failed to schedule a retry of {event.s3.object.key}")
+                return await message.nack(requeue=True)
+    await message.ack()
 
 
 async def main():
@@ -75,18 +309,104 @@ async def main():
         exchange = await channel.declare_exchange(
             exchange_name, ExchangeType.TOPIC, durable=True
         )
-        queue = await channel.declare_queue(queue_name, durable=True)
+        shards = sharding.shard_count()
+        # With sharding, one replica at a time dispatches the notifications,
+        # which keeps them in order. Queue arguments cannot be changed, so
+        # switching an existing deployment requires deleting the queue
+        queue = await channel.declare_queue(
+            queue_name,
+            durable=True,
+            arguments={"x-single-active-consumer": True} if shards else None,
+        )
         await queue.bind(exchange, queue_name)
+        context = Context(
+            channel=channel,
+            queue_name=queue_name,
+            scheduler=Scheduler.from_environ(),
+            retry_delays=amqputil.retry_delays(),
+            cache=ResultCache.from_environ(),
+            restapi=RestAPIClient.from_environ(),
+            spool=Spool.from_environ(),
+        )
+        await amqputil.declare_retry_queues(
+            channel, exchange_name, queue_name, context.retry_delays
+        )
+        if context.cache:
+            async with s3util.get_client("s3") as client:
+                await context.cache.setup(client)
 
-        await channel.set_qos(prefetch_count=0)
+        # Messages waiting for admission to a lane stay unacknowledged, by
+        # default hold no more of them than the lanes can run at once
+        lane_slots = sum(lane.concurrency for lane in context.scheduler.lanes)
+        prefetch = int(os.environ.get("AMQP_PREFETCH", str(lane_slots)))
+        logger.info(f"Prefetching {prefetch or 'unlimited'} messages")
+        await channel.set_qos(prefetch_count=prefetch)
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stopping.set)
         logger.info(" [*] Waiting for messages.")
-        async with queue.iterator() as iterator:
-            async for message in iterator:
-                await receive(message)
+        tasks: set[asyncio.Task] = set()
+
+        def reap(task: asyncio.Task):
+            tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                # e.g. the ack or nack failed, the broker redelivers the message
+                logger.error("Message handling failed", exc_info=task.exception())
+
+        async def spawn(message: AbstractIncomingMessage):
+            task = asyncio.create_task(receive(message, context))
+            tasks.add(task)
+            task.add_done_callback(reap)
+
+        consumers: list[tuple[AbstractQueue, str]] = []
+        if shards:
+            replica = sharding.replica_id()
+            shard_queues = await sharding.declare_shard_queues(
+                channel, queue_name, shards
+            )
+            for shard, shard_queue in enumerate(shard_queues):
+                consumer_tag = await shard_queue.consume(
+                    spawn,
+                    arguments={
+                        "x-priority": sharding.consumer_priority(replica, shard)
+                    },
+                )
+                consumers.append((shard_queue, consumer_tag))
+            logger.info(f"Replica {replica} consuming {shards} shards")
+
+        async def consume():
+            async with queue.iterator() as iterator:
+                async for message in iterator:
+                    if shards:
+                        # inline rather than in a task, to forward in order
+                        await dispatch(message, context, shards)
+                    else:
+                        await spawn(message)
+
+        consuming = asyncio.create_task(consume())
+        stopped = asyncio.create_task(stopping.wait())
+        await asyncio.wait([consuming, stopped], return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        if consuming.done():
+            return consuming.result()
+
+        # Stop taking new messages, give the ones in flight a chance to finish,
+        # then cancel the rest. Their downloads checkpoint as they unwind, and
+        # being unacknowledged they are redelivered once the channel closes
+        logger.info(f"Shutting down, {len(tasks)} messages in flight")
+        consuming.cancel()
+        for shard_queue, consumer_tag in consumers:
+            await shard_queue.cancel(consumer_tag)
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=INGEST_SHUTDOWN_GRACE)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        logger.info("Shut down")
 
 
 if __name__ == "__main__":
     logger.setLevel(logging.DEBUG)
     logging.basicConfig(level=logging.INFO)
-    # TODO: catch graceful termination
     exit(asyncio.run(main()))
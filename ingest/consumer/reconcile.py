@@ -0,0 +1,191 @@
+"""Find objects in transfer-inbox that were never ingested and enqueue them
+
+The bucket is listed concurrently, one lister per key prefix shard, and the
+listing is streamed page by page through a bounded queue so memory use does
+not grow with the size of the bucket
+"""
+
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+from typing import TYPE_CHECKING
+
+from aio_pika import DeliveryMode, ExchangeType, Message, connect_robust
+from aio_pika.abc import AbstractExchange
+
+from .message import AWSEvent
+from .restapi import RestAPIClient
+from .shared import s3util
+
+if TYPE_CHECKING:
+    from types_aiobotocore_s3.client import S3Client
+    from types_aiobotocore_s3.type_defs import ObjectTypeDef
+
+logger = logging.getLogger(__name__)
+
+BUCKET = "transfer-inbox"
+
+
+# A key prefix, and whether to list everything under it or only
+# the objects directly under it (up to the next '/')
+Shard = tuple[str, bool]
+
+
+async def discover_shards(client: "S3Client", prefix: str, depth: int) -> list[Shard]:
+    """Split the key space under prefix along '/' delimited common prefixes"""
+    if depth == 0:
+        return [(prefix, True)]
+    shards = [(prefix, False)]
+    paginator = client.get_paginator("list_objects_v2")
+    async for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix, Delimiter="/"):
+        for common in page.get("CommonPrefixes", []):
+            shards.extend(await discover_shards(client, common["Prefix"], depth - 1))
+    return shards
+
+
+async def list_shard(
+    client: "S3Client",
+    shard: Shard,
+    pages: "asyncio.Queue[list[ObjectTypeDef] | None]",
+):
+    prefix, recursive = shard
+    paginator = client.get_paginator("list_objects_v2")
+    if recursive:
+        listing = paginator.paginate(Bucket=BUCKET, Prefix=prefix)
+    else:
+        listing = paginator.paginate(Bucket=BUCKET, Prefix=prefix, Delimiter="/")
+    async for page in listing:
+        if contents := page.get("Contents"):
+            await pages.put(contents)
+
+
+def synthetic_event(obj: "ObjectTypeDef") -> AWSEvent:
+    return AWSEvent.model_validate(
+        {
+            "Records": [
+                {
+                    "eventVersion": "2.2",
+                    "eventTime": datetime.datetime.now(datetime.timezone.utc),
+                    "eventName": "ObjectCreated:Put",
+                    "userIdentity": {"principalId": "reconcile"},
+                    "s3": {
+                        "s3SchemaVersion": "1.0",
+                        "configurationId": "reconcile",
+                        "bucket": {
+                            "name": BUCKET,
+                            "ownerIdentity": {"principalId": "reconcile"},
+                        },
+                        "object": {
+                            "key": obj["Key"],
+                            "size": obj["Size"],
+                            "eTag": obj["ETag"].strip('"'),
+                            "sequencer": "0",
+                        },
+                    },
+                }
+            ]
+        }
+    )
+
+
+async def check_pages(
+    pages: "asyncio.Queue[list[ObjectTypeDef] | None]",
+    restapi: RestAPIClient,
+    exchange: AbstractExchange | None,
+    routing_key: str,
+    counts: dict[str, int],
+):
+    while (page := await pages.get()) is not None:
+        refs = [
+            {"bucket": BUCKET, "key": obj["Key"], "etag": obj["ETag"].strip('"')}
+            for obj in page
+        ]
+        missing = {ref["key"] for ref in await restapi.missing_files(refs)}
+        counts["listed"] += len(page)
+        counts["missing"] += len(missing)
+        for obj in page:
+            if obj["Key"] not in missing:
+                continue
+            logger.info(f"Missing: {obj['Key']}")
+            if exchange:
+                await exchange.publish(
+                    Message(
+                        synthetic_event(obj).model_dump_json().encode(),
+                        content_type="application/json",
+                        delivery_mode=DeliveryMode.PERSISTENT,
+                    ),
+                    routing_key=routing_key,
+                )
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--prefix", default="", help="Only reconcile keys under this")
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=1,
+        help="Levels of '/' delimited prefixes to split into shards",
+    )
+    parser.add_argument(
+        "--listers", type=int, default=16, help="Shards listed concurrently"
+    )
+    parser.add_argument(
+        "--checkers", type=int, default=4, help="Pages checked concurrently"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only report missing objects"
+    )
+    args = parser.parse_args()
+
+    restapi = RestAPIClient.from_environ()
+    if restapi is None:
+        raise RuntimeError("RESTAPI_URL is required to know what was ingested")
+    queue_name = os.environ["AMQP_TRANSFER_TOPIC"]
+    connection = await connect_robust(url=os.environ["AMQP_URL"])
+    async with connection, s3util.get_client("s3") as client:
+        exchange = None
+        if not args.dry_run:
+            channel = await connection.channel()
+            exchange = await channel.declare_exchange(
+                os.environ["AMQP_EXCHANGE"], ExchangeType.TOPIC, durable=True
+            )
+
+        shards = await discover_shards(client, args.prefix, args.depth)
+        logger.info(f"Listing {len(shards)} shards")
+        pages: asyncio.Queue[list[ObjectTypeDef] | None] = asyncio.Queue(
+            maxsize=2 * args.checkers
+        )
+        counts = {"listed": 0, "missing": 0}
+        semaphore = asyncio.Semaphore(args.listers)
+
+        async def lister(shard: Shard):
+            async with semaphore:
+                await list_shard(client, shard, pages)
+
+        async def list_all():
+            async with asyncio.TaskGroup() as listers:
+                for shard in shards:
+                    listers.create_task(lister(shard))
+            for _ in range(args.checkers):
+                await pages.put(None)
+
+        # If a checker fails, nothing drains pages any more and the listers
+        # would block on it forever; the task group cancels them instead
+        async with asyncio.TaskGroup() as tasks:
+            for _ in range(args.checkers):
+                tasks.create_task(
+                    check_pages(pages, restapi, exchange, queue_name, counts)
+                )
+            tasks.create_task(list_all())
+    await restapi.close()
+    action = "Would enqueue" if args.dry_run else "Enqueued"
+    logger.info(f"Listed {counts['listed']} objects. {action} {counts['missing']}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    exit(asyncio.run(main()))
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.parse
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+import httpx
+
+from .message import AWSRecord
+
+logger = logging.getLogger(__name__)
+
+
+class RestAPIClient:
+    """Client for the restapi, authenticated as the system user with ingest scope"""
+
+    def __init__(self, url: str, username: str, password: str, client_id: str):
+        self._client = httpx.AsyncClient(base_url=url)
+        self._login = {
+            "grant_type": "password",
+            "scope": "ingest",
+            "username": username,
+            "password": password,
+            "client_id": client_id,
+        }
+        self._token: str | None = None
+        self._token_expiry = 0.0
+
+    @classmethod
+    def from_environ(cls) -> "RestAPIClient | None":
+        url = os.environ.get("RESTAPI_URL")
+        if url is None:
+            return None
+        return cls(
+            url=url,
+            username=os.environ["SYSTEM_USERNAME"],
+            password=os.environ["SYSTEM_PASSWORD"],
+            client_id=os.environ["OAUTH_CLIENT_ID"],
+        )
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def _headers(self) -> dict[str, str]:
+        # tokens are valid for hours, renew well before they expire
+        if self._token is None or time.monotonic() > self._token_expiry:
+            response = await self._client.post("auth/token", data=self._login)
+            response.raise_for_status()
+            self._token = response.json()["access_token"]
+            self._token_expiry = time.monotonic() + 3600
+        return {"Authorization": f"Bearer {self._token}"}
+
+    async def register_file(
+        self,
+        event: AWSRecord,
+        status: str,
+        keys: list[dict[str, Any]] | None = None,
+    ):
+        """Create or update the catalog entry for the object in event"""
+        body: dict[str, Any] = {
+            "size": event.s3.object.size,
+            "etag": event.s3.object.eTag,
+            "status": status,
+        }
+        if keys is not None:
+            body["keys"] = keys
+        response = await self._client.put(
+            f"files/{event.s3.bucket.name}/{urllib.parse.quote(event.s3.object.key)}",
+            json=body,
+            headers=await self._headers(),
+        )
+        response.raise_for_status()
+
+    async def missing_files(self, files: list[dict[str, str]]) -> list[dict[str, str]]:
+        """Filter (bucket, key, etag) dicts down to those not yet ingested"""
+        response = await self._client.post(
+            "files/missing", json={"files": files}, headers=await self._headers()
+        )
+        response.raise_for_status()
+        return response.json()
+
+    @asynccontextmanager
+    async def stream_items(
+        self, event: AWSRecord
+    ) -> AsyncIterator[Callable[[str], Awaitable[None]]]:
+        """Stream converter output lines to the restapi as items
+
+        Yields a function to send each line with. The lines are forwarded
+        over a single streaming request as they are sent, and the summary
+        returned once the block exits. The items replace those of earlier
+        streams for the same object version, e.g. from a failed attempt
+        """
+        # listings quote the etag, notifications may not
+        file = {
+            "bucket": event.s3.bucket.name,
+            "key": event.s3.object.key,
+            "etag": event.s3.object.eTag.strip('"'),
+        }
+        queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=1024)
+
+        async def body():
+            while (chunk := await queue.get()) is not None:
+                yield chunk
+
+        request = asyncio.create_task(
+            self._client.post(
+                "items/stream",
+                params=file,
+                content=body(),
+                headers=await self._headers()
+                | {"Content-Type": "application/x-ndjson"},
+                timeout=None,
+            )
+        )
+
+        async def send(line: str):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return
+            item = {
+                "type": record.get("class", "unknown"),
+                "data": record | {"file": file},
+            }
+            put = asyncio.ensure_future(queue.put(json.dumps(item).encode() + b"\n"))
+            await asyncio.wait([put, request], return_when=asyncio.FIRST_COMPLETED)
+            if not put.done():
+                # the request ended before the stream did
+                put.cancel()
+                request.result().raise_for_status()
+                raise RuntimeError("Item stream closed early")
+
+        try:
+            yield send
+        except BaseException:
+            request.cancel()
+            raise
+        await queue.put(None)
+        response = await request
+        response.raise_for_status()
+        logger.info(f"Registered items for {event.s3.object.key}: {response.json()}")
+
+
+def parse_keys(lines: list[str]) -> list[dict[str, Any]]:
+    """Key listing from the converter output, skipping anything but JSON objects"""
+    keys = []
+    for line in lines:
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            logger.warning(f"Unexpected converter output: {line}")
+            continue
+        if isinstance(msg, dict):
+            keys.append(msg)
+    return keys
@@ -0,0 +1,92 @@
+import asyncio
+import dataclasses
+import logging
+import os
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ByteBudget:
+    """Admits jobs while their combined size fits in a fixed budget
+
+    A job larger than the whole budget is admitted once nothing else is running
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int):
+        size = min(size, self.capacity)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used + size <= self.capacity)
+            self.used += size
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.used -= size
+                self._condition.notify_all()
+
+
+@dataclasses.dataclass
+class Lane:
+    """A class of jobs with its own concurrency limit and byte budget
+
+    max_size is the largest object routed to this lane (None for no limit)
+    budget is the memory/disk space that admitted jobs may occupy together
+    """
+
+    name: str
+    max_size: int | None
+    concurrency: int
+    budget: int
+
+    def __post_init__(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._budget = ByteBudget(self.budget)
+
+    @asynccontextmanager
+    async def admit(self, size: int):
+        async with self._slots:
+            async with self._budget.reserve(size):
+                yield
+
+
+class Scheduler:
+    """Routes jobs to lanes by object size"""
+
+    def __init__(self, lanes: list[Lane]):
+        if not lanes or lanes[-1].max_size is not None:
+            raise ValueError("The last lane must accept objects of any size")
+        self.lanes = lanes
+
+    def lane_for(self, size: int) -> Lane:
+        for lane in self.lanes:
+            if lane.max_size is None or size <= lane.max_size:
+                return lane
+        raise AssertionError("unreachable")
+
+    @classmethod
+    def from_environ(cls) -> "Scheduler":
+        threshold = int(os.environ.get("INGEST_LARGE_THRESHOLD", str(1024**3)))
+        lanes = [
+            Lane(
+                name="small",
+                max_size=threshold,
+                concurrency=int(os.environ.get("INGEST_SMALL_CONCURRENCY", "4")),
+                budget=int(os.environ.get("INGEST_SMALL_BUDGET", str(2 * 1024**3))),
+            ),
+            Lane(
+                name="large",
+                max_size=None,
+                concurrency=int(os.environ.get("INGEST_LARGE_CONCURRENCY", "1")),
+                budget=int(os.environ.get("INGEST_LARGE_BUDGET", str(100 * 1024**3))),
+            ),
+        ]
+        for lane in lanes:
+            logger.info(f"Lane {lane}")
+        return cls(lanes)
@@ -0,0 +1,103 @@
+"""Key-affinity sharding of ingest work across consumer replicas
+
+With INGEST_SHARDS=N, the notification queue is consumed by a single active
+dispatcher which republishes each event to one of N shard queues, chosen by
+a stable hash of bucket/key. Every replica subscribes to every shard queue,
+which are single-active-consumer quorum queues, with a consumer priority
+derived from a rendezvous hash of (replica, shard). RabbitMQ (>= 3.12) makes
+the highest priority consumer of each queue the active one, so each shard is
+owned by one replica, and shards move to their next-highest replica as
+replicas join or leave. Events for one key are thus handled in order on one
+replica.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+from contextlib import asynccontextmanager
+
+from aio_pika.abc import AbstractChannel, AbstractQueue
+
+logger = logging.getLogger(__name__)
+
+# Consumer priorities are non-negative integers, 24 bits of hash is plenty
+PRIORITY_BITS = 24
+
+
+def shard_count() -> int:
+    """Number of shard queues, 0 (the default) to disable sharding"""
+    return int(os.environ.get("INGEST_SHARDS", "0"))
+
+
+def replica_id() -> str:
+    # The pod name is stable for the lifetime of a replica
+    return os.environ.get("INGEST_REPLICA_ID") or socket.gethostname()
+
+
+def _hash(value: str) -> int:
+    # Python's hash() is salted per process, so it cannot be shared
+    return int.from_bytes(hashlib.sha256(value.encode()).digest()[:8], "big")
+
+
+def shard_for(bucket: str, key: str, shards: int) -> int:
+    return _hash(f"{bucket}/{key}") % shards
+
+
+def shard_queue_name(queue_name: str, shard: int) -> str:
+    return f"{queue_name}.shard.{shard}"
+
+
+def consumer_priority(replica: str, shard: int) -> int:
+    """Rendezvous hash weight of replica for shard
+
+    The replica with the highest weight owns the shard; since weights do not
+    depend on the other replicas, only the shards of a replica that joins or
+    leaves change owner
+    """
+    return _hash(f"{replica}/{shard}") >> (64 - PRIORITY_BITS)
+
+
+async def declare_shard_queues(
+    channel: AbstractChannel, queue_name: str, shards: int
+) -> list[AbstractQueue]:
+    return [
+        await channel.declare_queue(
+            shard_queue_name(queue_name, shard),
+            durable=True,
+            arguments={
+                "x-queue-type": "quorum",
+                "x-single-active-consumer": True,
+            },
+        )
+        for shard in range(shards)
+    ]
+
+
+class KeyLocks:
+    """One lock per object key, held while its event is processed
+
+    Locks are created on demand and dropped once nobody holds or waits for
+    them. asyncio.Lock is fair, so events for a key run in arrival order.
+    """
+
+    def __init__(self):
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._users: dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
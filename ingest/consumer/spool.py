@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from .shared import s3util
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Spool:
+    """Downloads kept on local disk so they can be resumed
+
+    Each object version (bucket, key, eTag) has a partial file <name>.part and
+    a checkpoint <name>.json recording how many bytes of it are on disk.
+    The checkpoint is written every checkpoint_bytes and whenever a download
+    stops, e.g. when it is cancelled at shutdown, so a retry resumes with a
+    ranged GET. Entries not in use are removed once older than max_age
+    seconds, and then oldest first while the spool exceeds max_bytes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int,
+        max_age: float,
+        checkpoint_bytes: int = 64 * 1024 * 1024,
+        collect_interval: float = 300.0,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.checkpoint_bytes = checkpoint_bytes
+        self.collect_interval = collect_interval
+        self._active: set[str] = set()
+        self._last_collection = 0.0
+        os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def from_environ(cls) -> "Spool | None":
+        path = os.environ.get("INGEST_SPOOL_DIR")
+        if path is None:
+            return None
+        return cls(
+            path,
+            max_bytes=int(os.environ.get("INGEST_SPOOL_BUDGET", str(100 * 1024**3))),
+            max_age=float(os.environ.get("INGEST_SPOOL_MAX_AGE", str(24 * 3600))),
+        )
+
+    def _name(self, bucket: str, key: str, etag: str) -> str:
+        # keys can be long and contain '/', so entries are named by hash
+        return hashlib.sha256(f"{bucket}\0{key}\0{etag}".encode()).hexdigest()
+
+    def _paths(self, name: str) -> tuple[str, str]:
+        base = os.path.join(self.path, name)
+        return base + ".part", base + ".json"
+
+    def _checkpoint(self, name: str) -> dict | None:
+        try:
+            with open(self._paths(name)[1]) as fin:
+                return json.load(fin)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_checkpoint(self, name: str, checkpoint: dict):
+        path = self._paths(name)[1]
+        with open(path + ".tmp", "w") as fout:
+            json.dump(checkpoint, fout)
+        os.replace(path + ".tmp", path)
+
+    async def download(self, bucket: str, key: str, etag: str, size: int) -> str:
+        """Download an object version to the spool, resuming a partial download
+
+        Returns the path of the complete file, which stays in the spool
+        until release()
+        """
+        self.collect()
+        name = self._name(bucket, key, etag)
+        self._active.add(name)
+        try:
+            return await self._download(name, bucket, key, etag, size)
+        except BaseException:
+            self._active.discard(name)
+            raise
+
+    async def _download(
+        self, name: str, bucket: str, key: str, etag: str, size: int
+    ) -> str:
+        part, _ = self._paths(name)
+        checkpoint = self._checkpoint(name)
+        resumed = checkpoint is not None and os.path.exists(part)
+        offset = checkpoint["offset"] if checkpoint and resumed else 0
+        if resumed and offset >= size:
+            logger.info(f"Found {key} in spool")
+            return part
+
+        async with s3util.get_client("s3") as client:
+            try:
+                if offset:
+                    # If-Match makes sure the rest belongs to the same version
+                    result = await client.get_object(
+                        Bucket=bucket, Key=key, Range=f"bytes={offset}-", IfMatch=etag
+                    )
+                    logger.info(f"Resuming download of {key} at byte {offset}")
+                else:
+                    result = await client.get_object(Bucket=bucket, Key=key)
+            except ClientError as ex:
+                if ex.response["Error"]["Code"] not in ("PreconditionFailed", "412"):
+                    raise
+                logger.warning(f"{key} changed since the partial download, restarting")
+                offset = 0
+                result = await client.get_object(Bucket=bucket, Key=key)
+            # a new version may have replaced the object since the event,
+            # its bytes are fine to convert but must not be resumed as etag's
+            resumable = result["ETag"].strip('"') == etag.strip('"')
+            if not resumable:
+                self._remove(self._paths(name)[1])
+
+            with open(part, "r+b" if offset else "wb") as fout:
+                fout.truncate(offset)
+                fout.seek(offset)
+
+                async def save():
+                    fout.flush()
+                    # fsync can take a while on a busy disk
+                    await asyncio.to_thread(os.fsync, fout.fileno())
+                    if resumable:
+                        self._write_checkpoint(
+                            name,
+                            {
+                                "bucket": bucket,
+                                "key": key,
+                                "eTag": etag,
+                                "offset": offset,
+                            },
+                        )
+
+                logger.info("Starting download")
+                unsaved = 0
+                try:
+                    body = result["Body"]
+                    async for chunk in body.iter_chunks(  # type: ignore[attr-defined]
+                        chunk_size=CHUNK_SIZE
+                    ):
+                        fout.write(chunk)
+                        offset += len(chunk)
+                        unsaved += len(chunk)
+                        if unsaved >= self.checkpoint_bytes:
+                            await save()
+                            unsaved = 0
+                finally:
+                    await save()
+                    if offset < size:
+                        logger.info(f"Stopped download of {key} at byte {offset}")
+                logger.info("Finished download")
+        return part
+
+    def release(self, bucket: str, key: str, etag: str, keep: bool = False):
+        """Done with a downloaded object version, remove it unless keep
+
+        A kept file saves downloading it again if its event is retried
+        """
+        name = self._name(bucket, key, etag)
+        self._active.discard(name)
+        if not keep:
+            self._remove(*self._paths(name))
+
+    def _remove(self, *paths: str):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def collect(self, force: bool = False):
+        """Garbage-collect entries that are not in use by age and disk budget"""
+        now = time.time()
+        if not force and now - self._last_collection < self.collect_interval:
+            return
+        self._last_collection = now
+        entries: list[tuple[float, int, str]] = []
+        for filename in os.listdir(self.path):
+            name, ext = os.path.splitext(filename)
+            if ext != ".part" or name in self._active:
+                continue
+            # the checkpoint is rewritten as the download progresses
+            paths = self._paths(name)
+            try:
+                stat = os.stat(paths[1] if os.path.exists(paths[1]) else paths[0])
+                size = os.path.getsize(paths[0])
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, name in entries:
+            if now - mtime < self.max_age and total <= self.max_bytes:
+                break
+            logger.info(f"Removing spool entry {name} ({size} bytes)")
+            self._remove(*self._paths(name))
+            total -= size
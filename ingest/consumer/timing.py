@@ -0,0 +1,34 @@
+import collections
+import contextlib
+import time
+from typing import Iterator
+
+
+class StageTimings:
+    """Accumulated wall time of each processing stage"""
+
+    def __init__(self):
+        self.totals: dict[str, float] = collections.defaultdict(float)
+        self.counts: dict[str, int] = collections.defaultdict(int)
+
+    def record(self, stage: str, seconds: float):
+        self.totals[stage] += seconds
+        self.counts[stage] += 1
+
+    @contextlib.contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        return {
+            stage: {
+                "count": self.counts[stage],
+                "total_s": total,
+                "mean_s": total / self.counts[stage],
+            }
+            for stage, total in self.totals.items()
+        }
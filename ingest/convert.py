@@ -1,15 +1,165 @@
-import sys
+import argparse
+import dataclasses
 import json
+import multiprocessing
+import os
+from typing import Iterable
 
 import ROOT
 
+# The file as opened in each worker process
+_file = None
+
+
+@dataclasses.dataclass
+class Unit:
+    """A piece of conversion work: one object, or an entry range of a tree"""
+
+    index: int
+    name: str
+    cycle: int
+    classname: str
+    start: int = 0
+    stop: int = 0
+
+
+def open_file(path: str):
+    fp = ROOT.TFile.Open(path)
+    if not fp or fp.IsZombie():
+        raise RuntimeError(f"Failed to open {path}")
+    return fp
+
+
+def init_worker(path: str):
+    global _file
+    _file = open_file(path)
+
+
+def cluster_ranges(tree, max_entries: int) -> list[tuple[int, int]]:
+    """Split a tree into entry ranges of whole clusters, about max_entries each"""
+    entries = tree.GetEntries()
+    ranges: list[tuple[int, int]] = []
+    clusters = tree.GetClusterIterator(0)
+    start = clusters.Next()
+    while start < entries:
+        stop = min(clusters.GetNextEntry(), entries)
+        if ranges and ranges[-1][1] - ranges[-1][0] < max_entries:
+            ranges[-1] = (ranges[-1][0], stop)
+        else:
+            ranges.append((start, stop))
+        start = clusters.Next()
+    return ranges
+
+
+def plan(fp, max_entries: int | None) -> list[Unit]:
+    """Units of work for each key, trees split if max_entries is given"""
+    units = []
+    for index, key in enumerate(fp.GetListOfKeys()):
+        unit = Unit(index, key.GetName(), key.GetCycle(), key.GetClassName())
+        if unit.classname == "TTree":
+            tree = key.ReadObj()
+            if max_entries is None:
+                ranges = [(0, tree.GetEntries())]
+            else:
+                ranges = cluster_ranges(tree, max_entries)
+            # an empty tree has no clusters, but still gets its line
+            for start, stop in ranges or [(0, 0)]:
+                units.append(dataclasses.replace(unit, start=start, stop=stop))
+        else:
+            units.append(unit)
+    return units
+
+
+def count(unit: Unit) -> dict:
+    """Statistics of a unit that can be had without reading its data"""
+    if unit.classname == "TTree":
+        return {"entries": unit.stop - unit.start}
+    return {}
+
+
+def run(unit: Unit) -> dict:
+    """Convert one unit of work in a worker, returning its statistics"""
+    assert _file is not None
+    obj = _file.Get(f"{unit.name};{unit.cycle}")
+    if unit.classname == "TTree":
+        nbytes = sum(obj.GetEntry(i) for i in range(unit.start, unit.stop))
+        return {"entries": unit.stop - unit.start, "bytes": nbytes}
+    if unit.classname == "RNTuple":
+        pass
+    return {}
+
+
+def emit(units: list[Unit], results: Iterable[dict]):
+    """Print one line per key, merging the results of its units"""
+    msg: dict | None = None
+    for unit, result in zip(units, results):
+        if msg is None or msg["index"] != unit.index:
+            if msg is not None:
+                del msg["index"]
+                print(json.dumps(msg), flush=True)
+            msg = {"index": unit.index, "key": unit.name, "class": unit.classname}
+        for field, value in result.items():
+            msg[field] = msg.get(field, 0) + value
+    if msg is not None:
+        del msg["index"]
+        print(json.dumps(msg), flush=True)
+
+
+def convert(path: str, jobs: int, max_entries: int, read_entries: bool):
+    if not read_entries:
+        units = plan(_file, None)
+        emit(units, map(count, units))
+        return
+    units = plan(_file, max_entries)
+    if jobs == 1:
+        emit(units, map(run, units))
+        return
+    # spawn, since forking after ROOT has started its threads is unsafe
+    context = multiprocessing.get_context("spawn")
+    if path.startswith("/proc/self/fd/"):
+        # spawned workers don't inherit a descriptor we were given, but can
+        # reach it through our pid
+        path = f"/proc/{os.getpid()}/fd/" + path.removeprefix("/proc/self/fd/")
+    with context.Pool(jobs, initializer=init_worker, initargs=(path,)) as pool:
+        # imap yields results in order while later units are still running
+        emit(units, pool.imap(run, units))
+
+
 if __name__ == "__main__":
-    fp = ROOT.TFile.Open(sys.argv[1])
-    for key in fp.GetListOfKeys():
-        msg = {
-            "key": key.GetName(),
-            "class": key.GetClassName(),
-        }
-        print(json.dumps(msg))
-        if msg["class"] == "RNTuple":
-            pass
+    parser = argparse.ArgumentParser(description="Convert a ROOT file")
+    parser.add_argument("input", help="Path or URL (read with ranged requests)")
+    parser.add_argument(
+        "--metadata-only",
+        action="store_true",
+        help="Only list the keys, without reading any object data",
+    )
+    parser.add_argument(
+        "--read-entries",
+        action="store_true",
+        help="Read (and decompress) every tree entry, e.g. to report bytes",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Worker processes for --read-entries (0 for one per available CPU)",
+    )
+    parser.add_argument(
+        "--max-entries",
+        type=int,
+        default=1_000_000,
+        help="Approximate number of tree entries per unit of work",
+    )
+    args = parser.parse_args()
+
+    init_worker(args.input)
+    if args.metadata_only:
+        for key in _file.GetListOfKeys():
+            msg = {
+                "key": key.GetName(),
+                "class": key.GetClassName(),
+            }
+            print(json.dumps(msg))
+    else:
+        jobs = args.jobs or len(os.sched_getaffinity(0))
+        convert(args.input, jobs, args.max_entries, args.read_entries)
@@ -0,0 +1,32 @@
+"""add item file index
+
+Revision ID: 1b7f3d9c0e25
+Revises: e93f5b0a7c12
+Create Date: 2026-10-19 19:12:04.631847
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op  # type: ignore[attr-defined]
+
+# revision identifiers, used by Alembic.
+revision: str = "1b7f3d9c0e25"
+down_revision: Union[str, None] = "e93f5b0a7c12"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # items streamed for a file version are replaced when it is ingested again
+    op.create_index(
+        "ix_items_file",
+        "items",
+        [sa.text("(data::jsonb -> 'file')")],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_items_file", table_name="items")
@@ -0,0 +1,141 @@
+"""add item stats
+
+Revision ID: c41d7a9e3b58
+Revises: 8b2e4d61f0a7
+Create Date: 2026-10-19 15:40:12.904377
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op  # type: ignore[attr-defined]
+
+# revision identifiers, used by Alembic.
+revision: str = "c41d7a9e3b58"
+down_revision: Union[str, None] = "8b2e4d61f0a7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Statement-level triggers fold each statement's transition table into
+# item_stats. Rows are upserted in key order so that concurrent statements
+# lock them in the same order. A removed row may have been the latest of its
+# group, so that is looked up again (ix_items_owner_id_type_create_date).
+MAINTAIN_ITEM_STATS = """
+CREATE FUNCTION maintain_item_stats() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        WITH removed AS (
+            SELECT
+                owner_id,
+                type,
+                count(*) AS count,
+                sum(octet_length(data::text)) AS data_size,
+                max(create_date) AS latest_create_date
+            FROM old_items
+            GROUP BY owner_id, type
+            ORDER BY owner_id, type
+        )
+        UPDATE item_stats AS s
+        SET
+            count = s.count - r.count,
+            data_size = s.data_size - r.data_size,
+            latest_create_date = CASE
+                WHEN r.latest_create_date < s.latest_create_date
+                THEN s.latest_create_date
+                -- a group with no rows left is deleted below
+                ELSE coalesce((
+                    SELECT max(i.create_date) FROM items AS i
+                    WHERE i.owner_id = s.owner_id AND i.type = s.type
+                ), s.latest_create_date)
+            END
+        FROM removed AS r
+        WHERE s.owner_id = r.owner_id AND s.type = r.type;
+
+        DELETE FROM item_stats AS s
+        USING (SELECT DISTINCT owner_id, type FROM old_items) AS r
+        WHERE s.owner_id = r.owner_id AND s.type = r.type AND s.count <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO item_stats AS s
+            (owner_id, type, count, data_size, latest_create_date)
+        SELECT
+            owner_id,
+            type,
+            count(*),
+            sum(octet_length(data::text)),
+            max(create_date)
+        FROM new_items
+        GROUP BY owner_id, type
+        ORDER BY owner_id, type
+        ON CONFLICT (owner_id, type) DO UPDATE SET
+            count = s.count + excluded.count,
+            data_size = s.data_size + excluded.data_size,
+            latest_create_date = greatest(
+                s.latest_create_date, excluded.latest_create_date
+            );
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+# Transition tables are only allowed on single-event triggers
+TRIGGERS = {
+    "item_stats_insert": "INSERT REFERENCING NEW TABLE AS new_items",
+    "item_stats_update": (
+        "UPDATE REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items"
+    ),
+    "item_stats_delete": "DELETE REFERENCING OLD TABLE AS old_items",
+}
+
+
+def upgrade() -> None:
+    op.create_table(
+        "item_stats",
+        sa.Column("owner_id", sa.String(), nullable=False),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.Column("data_size", sa.BigInteger(), nullable=False),
+        sa.Column("latest_create_date", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["owner_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("owner_id", "type"),
+    )
+    op.create_index(
+        "ix_items_owner_id_type_create_date",
+        "items",
+        ["owner_id", "type", "create_date"],
+        unique=False,
+    )
+    op.execute(MAINTAIN_ITEM_STATS)
+    # creating the triggers locks out writes to items until the backfill
+    # below commits
+    for name, event in TRIGGERS.items():
+        op.execute(
+            f"CREATE TRIGGER {name} AFTER {event} ON items "
+            "FOR EACH STATEMENT EXECUTE FUNCTION maintain_item_stats()"
+        )
+    op.execute("""
+        INSERT INTO item_stats
+            (owner_id, type, count, data_size, latest_create_date)
+        SELECT
+            owner_id,
+            type,
+            count(*),
+            sum(octet_length(data::text)),
+            max(create_date)
+        FROM items
+        GROUP BY owner_id, type
+        """)
+
+
+def downgrade() -> None:
+    for name in TRIGGERS:
+        op.execute(f"DROP TRIGGER {name} ON items")
+    op.execute("DROP FUNCTION maintain_item_stats()")
+    op.drop_index("ix_items_owner_id_type_create_date", table_name="items")
+    op.drop_table("item_stats")
@@ -0,0 +1,163 @@
+"""partition items by create_date
+
+Revision ID: e93f5b0a7c12
+Revises: 5e7a0c93d2f1
+Create Date: 2026-10-19 17:05:51.118204
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op  # type: ignore[attr-defined]
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "e93f5b0a7c12"
+down_revision: Union[str, None] = "5e7a0c93d2f1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Months of partitions to create ahead, app.retention keeps this up
+PARTITIONS_AHEAD = "3 months"
+
+# One partition per calendar month (UTC), named items_pYYYYMM. Month
+# arithmetic is done on UTC wall time, timestamptz would use the session's
+# time zone. Returns the names of the partitions it created.
+CREATE_ITEM_PARTITIONS = """
+CREATE FUNCTION create_item_partitions(since timestamptz, until timestamptz)
+RETURNS SETOF text
+LANGUAGE plpgsql AS $$
+DECLARE
+    month_start timestamp := date_trunc('month', since AT TIME ZONE 'UTC');
+    partition_name text;
+BEGIN
+    WHILE month_start AT TIME ZONE 'UTC' < until LOOP
+        partition_name := 'items_p' || to_char(month_start, 'YYYYMM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF items FOR VALUES FROM (%L) TO (%L)',
+                partition_name,
+                month_start AT TIME ZONE 'UTC',
+                (month_start + interval '1 month') AT TIME ZONE 'UTC'
+            );
+            RETURN NEXT partition_name;
+        END IF;
+        month_start := month_start + interval '1 month';
+    END LOOP;
+END
+$$
+"""
+
+# As in the add_item_stats migration
+TRIGGERS = {
+    "item_stats_insert": "INSERT REFERENCING NEW TABLE AS new_items",
+    "item_stats_update": (
+        "UPDATE REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items"
+    ),
+    "item_stats_delete": "DELETE REFERENCING OLD TABLE AS old_items",
+}
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple'::regconfig, type), 'A') || "
+    "setweight(jsonb_to_tsvector("
+    "'simple'::regconfig, data::jsonb, '[\"string\"]'), 'B')"
+)
+
+
+def _set_aside_items():
+    # The existing table is copied into its replacement, which takes over
+    # its sequence, constraint and index names
+    op.rename_table("items", "items_old")
+    op.execute("ALTER SEQUENCE items_id_seq OWNED BY NONE")
+    for name in TRIGGERS:
+        op.execute(f"DROP TRIGGER {name} ON items_old")
+    op.drop_index("ix_items_search", table_name="items_old")
+    op.drop_index("ix_items_owner_id_type_create_date", table_name="items_old")
+    op.execute("ALTER TABLE items_old RENAME CONSTRAINT items_pkey TO items_old_pkey")
+    op.drop_constraint("items_owner_id_fkey", "items_old", type_="foreignkey")
+
+
+def _create_items(primary_key: list[str], **kwargs):
+    op.create_table(
+        "items",
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=sa.text("nextval('items_id_seq'::regclass)"),
+            nullable=False,
+        ),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column(
+            "create_date",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("owner_id", sa.String(), nullable=False),
+        sa.Column("data", sa.JSON(), nullable=False),
+        sa.Column(
+            "search",
+            postgresql.TSVECTOR(),
+            sa.Computed(SEARCH_VECTOR, persisted=True),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["owner_id"], ["users.id"], name="items_owner_id_fkey"),
+        sa.PrimaryKeyConstraint(*primary_key, name="items_pkey"),
+        **kwargs,
+    )
+
+
+def _finish_items():
+    # rows are copied without the triggers, item_stats already counts them
+    op.execute("""
+        INSERT INTO items (id, type, create_date, owner_id, data)
+        SELECT id, type, create_date, owner_id, data FROM items_old
+        """)
+    op.drop_table("items_old")
+    op.execute("ALTER SEQUENCE items_id_seq OWNED BY items.id")
+    # indexes are built after the copy, on the partitioned table they are
+    # created on every partition
+    op.create_index(
+        "ix_items_search",
+        "items",
+        ["search"],
+        unique=False,
+        postgresql_using="gin",
+    )
+    op.create_index(
+        "ix_items_owner_id_type_create_date",
+        "items",
+        ["owner_id", "type", "create_date"],
+        unique=False,
+    )
+    for name, event in TRIGGERS.items():
+        op.execute(
+            f"CREATE TRIGGER {name} AFTER {event} ON items "
+            "FOR EACH STATEMENT EXECUTE FUNCTION maintain_item_stats()"
+        )
+
+
+def upgrade() -> None:
+    # This rewrites the table, writes to items are locked out until it commits
+    _set_aside_items()
+    # the partition key has to be part of the primary key
+    _create_items(["id", "create_date"], postgresql_partition_by="RANGE (create_date)")
+    op.execute(CREATE_ITEM_PARTITIONS)
+    op.execute(f"""
+        SELECT create_item_partitions(
+            (SELECT coalesce(min(create_date), now()) FROM items_old),
+            now() + interval '{PARTITIONS_AHEAD}'
+        )
+        """)
+    # No DEFAULT partition: Postgres cannot create a partition for a month
+    # that has rows in it. Items are created at now(), which app.retention
+    # keeps covered.
+    _finish_items()
+
+
+def downgrade() -> None:
+    _set_aside_items()
+    _create_items(["id"])
+    _finish_items()
+    op.execute("DROP FUNCTION create_item_partitions(timestamptz, timestamptz)")
@@ -0,0 +1,178 @@
+import asyncio
+import collections
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Literal
+
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from .auth import SYSTEM_USERNAME, Administrator, AuthorizedUser
+from .shared.models.admission import AdmissionMetrics, LimiterMetrics, RateLimitMetrics
+
+RouteClass = Literal["reads", "writes", "bulk", "streams"]
+
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "1"))
+# The ingest consumer authenticates as the system user, its bursts are
+# bounded by the concurrency limits alone
+RATE_LIMIT_EXEMPT_SUBS = {SYSTEM_USERNAME} | set(
+    filter(None, os.environ.get("RATE_LIMIT_EXEMPT_SUBS", "").split(","))
+)
+
+
+class ConcurrencyLimiter:
+    """Bounds the requests of a route class in flight and waiting
+
+    Once queue_size requests are waiting for one of the limit slots, further
+    requests are turned away immediately rather than piling up behind the
+    database connection pool
+    """
+
+    def __init__(self, route_class: str, limit: int, queue_size: int):
+        self.route_class = route_class
+        self.limit = limit
+        self.queue_size = queue_size
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        if self._semaphore.locked() and self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise HTTPException(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, retry later",
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+            )
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def metrics(self) -> LimiterMetrics:
+        return LimiterMetrics(
+            route_class=self.route_class,
+            limit=self.limit,
+            queue_size=self.queue_size,
+            active=self.active,
+            waiting=self.waiting,
+            admitted=self.admitted,
+            rejected=self.rejected,
+        )
+
+
+class RateLimiter:
+    """Token bucket per subject, refilled at rate tokens per second"""
+
+    def __init__(self, rate: float, burst: int, max_subjects: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_subjects = max_subjects
+        # subject -> (tokens, time of last update), least recently used first
+        self._buckets: collections.OrderedDict[str, tuple[float, float]] = (
+            collections.OrderedDict()
+        )
+        self.rejected = 0
+
+    def acquire(self, subject: str) -> float:
+        """Take a token for subject
+
+        Returns 0 if one was available, otherwise the seconds until there is
+        """
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(subject, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.rejected += 1
+        self._buckets[subject] = (tokens, now)
+        while len(self._buckets) > self.max_subjects:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def metrics(self) -> RateLimitMetrics:
+        return RateLimitMetrics(
+            rate=self.rate,
+            burst=self.burst,
+            subjects=len(self._buckets),
+            rejected=self.rejected,
+        )
+
+
+limiters: dict[RouteClass, ConcurrencyLimiter] = {
+    route_class: ConcurrencyLimiter(
+        route_class,
+        limit=int(os.environ.get(f"ADMISSION_{route_class.upper()}_LIMIT", limit)),
+        queue_size=int(os.environ.get(f"ADMISSION_{route_class.upper()}_QUEUE", queue)),
+    )
+    for route_class, limit, queue in [
+        ("reads", "32", "128"),
+        ("writes", "16", "64"),
+        # long running batch requests
+        ("bulk", "4", "4"),
+        # the ingest consumer's item streams, each open for a whole conversion
+        ("streams", "64", "64"),
+    ]
+}
+rate_limiter = RateLimiter(
+    rate=float(os.environ.get("RATE_LIMIT_PER_SECOND", "50")),
+    burst=int(os.environ.get("RATE_LIMIT_BURST", "100")),
+)
+
+
+def admission(route_class: RouteClass):
+    """Dependency rate limiting the user, then admitting the request to route_class
+
+    It should come before any dependency holding a database session, so that
+    waiting requests do not hold pool connections
+    """
+    limiter = limiters[route_class]
+
+    async def admit(user: AuthorizedUser) -> AsyncIterator[None]:
+        if user.sub not in RATE_LIMIT_EXEMPT_SUBS:
+            if wait := rate_limiter.acquire(user.sub):
+                raise HTTPException(
+                    status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Rate limit exceeded",
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+        async with limiter.admit():
+            yield
+
+    return Depends(admit)
+
+
+Reads = admission("reads")
+Writes = admission("writes")
+Bulk = admission("bulk")
+Streams = admission("streams")
+
+router = APIRouter(
+    prefix="/admission",
+    tags=["admission"],
+)
+
+
+@router.get("/metrics", response_model=AdmissionMetrics)
+async def read_metrics(user: Administrator):
+    return AdmissionMetrics(
+        limiters=[limiter.metrics() for limiter in limiters.values()],
+        rate_limit=rate_limiter.metrics(),
+    )
@@ -4,7 +4,15 @@ import logging
 import os
 from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, Request, Security, status
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    Request,
+    Security,
+    status,
+)
 from fastapi.openapi.models import OAuth2
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.security.oauth2 import SecurityScopes, get_authorization_scheme_param
@@ -12,7 +20,8 @@ from fastapi.security.open_id_connect_url import OpenIdConnect
 from jose import JWTError, jwk, jwt
 from pydantic import BaseModel, ValidationError, field_serializer
 
-from .shared import jwtutil
+from .provisioning import USER_PROVISIONING, user_provisioner
+from .shared import jwtutil, s3util
 from .shared.models.user import CurrentUser
 
 logger = logging.getLogger(__name__)
@@ -158,15 +167,22 @@ async def valid_token(
 
 
 async def authorized_user(
-    token: Annotated[TokenData, Depends(valid_token)]
+    token: Annotated[TokenData, Depends(valid_token)],
+    background_tasks: BackgroundTasks,
 ) -> CurrentUser:
-    return CurrentUser(
+    user = CurrentUser(
         sub=token.sub,
         username=token.preferred_username,
         email=token.email,
         name=token.name,
         scopes=token.scopes,
     )
+    # the system user has no storage of its own
+    if token.iss != system_issuer:
+        user.bucket = s3util.personal_bucket_name(user.username)
+        if USER_PROVISIONING:
+            user_provisioner.schedule(user, background_tasks)
+    return user
 
 
 AuthorizedUser = Annotated[CurrentUser, Depends(authorized_user)]
@@ -184,6 +200,8 @@ async def administrator(user: AuthorizedUser) -> CurrentUser:
 
 Administrator = Annotated[CurrentUser, Depends(administrator)]
 
+IngestUser = Annotated[CurrentUser, Security(authorized_user, scopes=["ingest"])]
+
 router = APIRouter(
     prefix="/auth",
     tags=["auth"],
@@ -3,7 +3,17 @@ import os
 from typing import Annotated
 
 from fastapi import Depends
-from sqlalchemy import DateTime, ForeignKey, func, types
+from sqlalchemy import (
+    BigInteger,
+    Computed,
+    DateTime,
+    ForeignKey,
+    Index,
+    func,
+    text,
+    types,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.asyncio import (
     AsyncAttrs,
     AsyncSession,
@@ -17,19 +27,63 @@ class ORMBase(AsyncAttrs, DeclarativeBase):
     pass
 
 
+# Words of the type, weighted above those of every string value in data
+ITEM_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple'::regconfig, type), 'A') || "
+    "setweight(jsonb_to_tsvector("
+    "'simple'::regconfig, data::jsonb, '[\"string\"]'), 'B')"
+)
+
+
 class Item(ORMBase):
+    """An item
+
+    The table is partitioned by month of create_date, see app.retention
+    """
+
     __tablename__ = "items"
+    __table_args__ = (
+        Index("ix_items_search", "search", postgresql_using="gin"),
+        Index("ix_items_owner_id_type_create_date", "owner_id", "type", "create_date"),
+        # the file version an item was streamed for, see /items/stream
+        Index("ix_items_file", text("(data::jsonb -> 'file')")),
+        {"postgresql_partition_by": "RANGE (create_date)"},
+    )
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     owner_id: Mapped[str] = mapped_column(ForeignKey("users.id"))
+    # the partition key has to be part of the table's primary key
     create_date: Mapped[datetime.datetime] = mapped_column(
-        DateTime(timezone=True), server_default=func.now()
+        DateTime(timezone=True), server_default=func.now(), primary_key=True
     )
     type: Mapped[str]
     data: Mapped[dict | list] = mapped_column(type_=types.JSON)
+    search: Mapped[str] = mapped_column(
+        TSVECTOR, Computed(ITEM_SEARCH_VECTOR, persisted=True), deferred=True
+    )
 
     owner: Mapped["User"] = relationship(back_populates="items")
 
+    # ids are unique on their own, so items are still identified by id alone
+    __mapper_args__ = {"primary_key": [id]}
+
+
+class ItemStats(ORMBase):
+    """Per owner and type summary of items
+
+    Maintained by triggers on items, see the add_item_stats migration
+    """
+
+    __tablename__ = "item_stats"
+
+    owner_id: Mapped[str] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    type: Mapped[str] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(BigInteger)
+    data_size: Mapped[int] = mapped_column(BigInteger)
+    latest_create_date: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True)
+    )
+
 
 class User(ORMBase):
     __tablename__ = "users"
@@ -38,6 +92,10 @@ class User(ORMBase):
     username: Mapped[str]
     email: Mapped[str]
     name: Mapped[str]
+    # set once the personal bucket and role exist, see provisioning.py
+    provisioned_at: Mapped[datetime.datetime | None] = mapped_column(
+        DateTime(timezone=True)
+    )
 
     items: Mapped[list[Item]] = relationship(back_populates="owner")
 
@@ -46,6 +104,41 @@ class User(ORMBase):
         return self.id
 
 
+class File(ORMBase):
+    __tablename__ = "files"
+    __table_args__ = (
+        # text_pattern_ops so that prefix (LIKE 'abc%') searches can use the index
+        Index(
+            "ix_files_key_id",
+            "key",
+            "id",
+            postgresql_ops={"key": "text_pattern_ops"},
+        ),
+        Index(
+            "ix_files_status_key_id",
+            "status",
+            "key",
+            "id",
+            postgresql_ops={"key": "text_pattern_ops"},
+        ),
+        Index("ix_files_bucket_key", "bucket", "key", unique=True),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    bucket: Mapped[str]
+    key: Mapped[str]
+    size: Mapped[int] = mapped_column(BigInteger)
+    etag: Mapped[str]
+    status: Mapped[str]
+    keys: Mapped[list | None] = mapped_column(type_=types.JSON)
+    create_date: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    update_date: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
 def get_dburl() -> str:
     dburl = os.environ["DB_URL"]
     if dburl.startswith("postgresql://"):
@@ -1,81 +1,300 @@
 import asyncio
+import contextlib
+import dataclasses
+import json
 import logging
 import os
+from typing import TYPE_CHECKING, Any, Awaitable
+
+from botocore.exceptions import ClientError
 
 from .shared import s3util
 
+if TYPE_CHECKING:
+    from types_aiobotocore_s3.client import S3Client
+
 logger = logging.getLogger(__name__)
 
+MINIO_TOPIC_ARN = "arn:minio:sqs::RABBITMQ:amqp"
 
-async def main() -> int:
-    servertype: str = os.environ["S3_VENDOR"]
-    if servertype not in ("MinIO", "RadosGW"):
-        raise RuntimeError(f"Unsupported or missing S3_VENDOR: {servertype!r}")
 
-    # Set up OpenID Connect
-    # For RadosGW we use IAM client to setup this
-    # For Minio, it is set in environment variables
-    if servertype == "RadosGW":
-        async with s3util.get_client("iam") as client:
-            oidc_provider_arn = await s3util.register_oidc_provider(
-                client, os.environ["OIDC_PROVIDER"], [os.environ["OAUTH_CLIENT_ID"]]
-            )
-            # TODO: create roles via REST endpoint
-            await s3util.create_oidc_role(
-                client, oidc_provider_arn, "ncsmith", "probablywrong"
+def load_oidc_roles() -> list[tuple[str, str]]:
+    """(username, oidc_subject) pairs to provision roles for up front
+
+    Read from the JSON list of pairs in OIDC_ROLES_FILE, if set. Other users
+    get their role on their first request, see provisioning.py
+    """
+    path = os.environ.get("OIDC_ROLES_FILE")
+    if path is None:
+        return []
+    with open(path) as fin:
+        return [(username, subject) for username, subject in json.load(fin)]
+
+
+@dataclasses.dataclass
+class NotificationSpec:
+    id: str
+    topic: str
+    events: "list[s3util.EventType]" = dataclasses.field(
+        default_factory=lambda: ["s3:ObjectCreated:*", "s3:ObjectRemoved:*"]
+    )
+
+
+@dataclasses.dataclass
+class BucketSpec:
+    name: str
+    # principal ARN -> policy type, see s3util.set_bucket_policy
+    policy: dict[str, s3util.PolicyType] = dataclasses.field(default_factory=dict)
+    notifications: list[NotificationSpec] = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class ClusterSpec:
+    topics: list[str]
+    buckets: list[BucketSpec]
+    roles: list[tuple[str, str]]
+
+    @classmethod
+    def from_dict(cls, spec: dict[str, Any]) -> "ClusterSpec":
+        return cls(
+            topics=list(spec.get("topics", [])),
+            buckets=[
+                BucketSpec(
+                    name=bucket["name"],
+                    policy=bucket.get("policy", {}),
+                    notifications=[
+                        NotificationSpec(**notification)
+                        for notification in bucket.get("notifications", [])
+                    ],
+                )
+                for bucket in spec.get("buckets", [])
+            ],
+            roles=(
+                [(username, subject) for username, subject in spec["roles"]]
+                if "roles" in spec
+                else load_oidc_roles()
+            ),
+        )
+
+
+def load_spec() -> ClusterSpec:
+    """Desired state of the cluster
+
+    Read from the JSON document in INIT_SPEC_FILE, if set, otherwise the
+    transfer inbox and its notification topic
+    """
+    path = os.environ.get("INIT_SPEC_FILE")
+    if path is not None:
+        with open(path) as fin:
+            return ClusterSpec.from_dict(json.load(fin))
+    topic = os.environ["AMQP_TRANSFER_TOPIC"]
+    return ClusterSpec(
+        topics=[topic],
+        buckets=[
+            BucketSpec(
+                name="transfer-inbox",
+                # allow FTS incoming data with cmsuser account
+                policy={"arn:aws:iam:::user/cmsuser": "read-write"},
+                notifications=[
+                    NotificationSpec(id="transfer-notifier-config", topic=topic)
+                ],
             )
+        ],
+        roles=load_oidc_roles(),
+    )
 
-    # Set up notification topics
-    # For Minio it has to be set up via environment variables and there is only one
-    queue_name = os.environ["AMQP_TRANSFER_TOPIC"]
-    topic_arn = "arn:minio:sqs::RABBITMQ:amqp"
-    if servertype == "RadosGW":
-        async with s3util.get_client("sns") as client:
-            topic_arn = await s3util.register_notification_topic(client, queue_name)
 
-    # Set up transfer-inbox bucket with notifications
-    notification_events: "list[s3util.EventType]" = [
-        "s3:ObjectCreated:*",
-        "s3:ObjectRemoved:*",
+async def reconcile_topics(servertype: str, topics: list[str]) -> dict[str, str]:
+    """Create missing notification topics, returns topic name -> ARN
+
+    For MinIO there is only one topic and it is set up via environment variables
+    """
+    if servertype != "RadosGW":
+        return {topic: MINIO_TOPIC_ARN for topic in topics}
+    async with s3util.get_client("sns") as client:
+        return await s3util.register_notification_topics(client, topics)
+
+
+async def reconcile_identity(
+    servertype: str, roles: list[tuple[str, str]]
+) -> list[str]:
+    """Register the OpenID connect provider and bring OIDC roles up to date
+
+    For MinIO, OpenID connect is set up via environment variables
+    """
+    if servertype != "RadosGW":
+        return []
+    # roles are named like the personal buckets, see provisioning.py
+    named_roles = []
+    for username, subject in roles:
+        name = s3util.personal_bucket_name(username)
+        if name is None:
+            raise RuntimeError(f"No valid role name for {username!r}")
+        named_roles.append((name, subject))
+    async with s3util.get_client("iam") as client:
+        oidc_provider_arn = await s3util.register_oidc_provider(
+            client, os.environ["OIDC_PROVIDER"], [os.environ["OAUTH_CLIENT_ID"]]
+        )
+        summary = await s3util.reconcile_oidc_roles(
+            client,
+            oidc_provider_arn,
+            named_roles,
+            max_concurrency=int(os.environ.get("IAM_CONCURRENCY", "16")),
+        )
+    if summary.failed:
+        raise RuntimeError(f"Failed to reconcile roles: {summary.failed}")
+    return [f"role {username} created" for username in summary.created] + [
+        f"role {username} updated" for username in summary.updated
     ]
-    notification_config: "s3util.NotificationConfigurationTypeDef" = {
-        "TopicConfigurations": [
-            {
-                "Id": "transfer-notifier-config",
-                "TopicArn": topic_arn,
-                "Events": notification_events,
-            }
-        ],
+
+
+async def _bucket_exists(client: "S3Client", bucket: str) -> bool:
+    try:
+        await client.head_bucket(Bucket=bucket)
+        return True
+    except ClientError as ex:
+        if ex.response["Error"]["Code"] in ("404", "NoSuchBucket"):
+            return False
+        raise
+
+
+async def _bucket_policy(client: "S3Client", bucket: str) -> dict | None:
+    try:
+        response = await client.get_bucket_policy(Bucket=bucket)
+    except ClientError as ex:
+        if ex.response["Error"]["Code"] in ("NoSuchBucketPolicy", "NoSuchBucket"):
+            return None
+        raise
+    return json.loads(response["Policy"])
+
+
+async def _bucket_notifications(client: "S3Client", bucket: str) -> dict:
+    try:
+        return dict(await client.get_bucket_notification_configuration(Bucket=bucket))
+    except ClientError as ex:
+        if ex.response["Error"]["Code"] == "NoSuchBucket":
+            return {}
+        raise
+
+
+def _notification_configuration(
+    servertype: str,
+    notifications: list[NotificationSpec],
+    topic_arns: dict[str, str],
+) -> "s3util.NotificationConfigurationTypeDef":
+    # RadosGW takes SNS topics, MinIO takes its (SQS-like) notification targets
+    if servertype == "RadosGW":
+        return {
+            "TopicConfigurations": [
+                {
+                    "Id": notification.id,
+                    "TopicArn": topic_arns[notification.topic],
+                    "Events": notification.events,
+                }
+                for notification in notifications
+            ]
+        }
+    return {
         "QueueConfigurations": [
             {
-                "Id": "transfer-notifier-config",
-                "QueueArn": topic_arn,
-                "Events": notification_events,
+                "Id": notification.id,
+                "QueueArn": topic_arns[notification.topic],
+                "Events": notification.events,
             }
-        ],
+            for notification in notifications
+        ]
     }
-    if servertype == "RadosGW":
-        del notification_config["QueueConfigurations"]
-    else:
-        del notification_config["TopicConfigurations"]
-
-    async with s3util.get_client("s3") as client:
-        await s3util.create_bucket(client, "transfer-inbox")
-        # allow FTS incoming data with cmsuser account
-        await s3util.set_bucket_policy(
-            client=client,
-            bucket="transfer-inbox",
-            policy_map={
-                "arn:aws:iam:::user/cmsuser": "read-write",
-            }
+
+
+def _notification_set(configuration: dict) -> set[tuple[str, str, frozenset[str]]]:
+    return {
+        (
+            notification.get("Id", ""),
+            notification.get("TopicArn") or notification.get("QueueArn", ""),
+            frozenset(notification["Events"]),
         )
+        for key in ("TopicConfigurations", "QueueConfigurations")
+        for notification in configuration.get(key, [])
+    }
+
+
+async def reconcile_bucket(
+    client: "S3Client",
+    servertype: str,
+    spec: BucketSpec,
+    topic_arns: Awaitable[dict[str, str]],
+) -> list[str]:
+    """Create the bucket and set its policy and notifications, if they differ
+
+    The current state is read concurrently; only differing parts are written
+    """
+    exists, current_policy, current_notifications = await asyncio.gather(
+        _bucket_exists(client, spec.name),
+        _bucket_policy(client, spec.name),
+        _bucket_notifications(client, spec.name),
+    )
+    changes = []
+    if not exists:
+        await s3util.create_bucket(client, spec.name)
+        changes.append(f"bucket {spec.name} created")
+
+    if spec.policy:
+        policy = s3util.bucket_policy(spec.name, spec.policy)
+        if current_policy is None or s3util.normalize_policy(
+            current_policy
+        ) != s3util.normalize_policy(policy):
+            await s3util.set_bucket_policy(client, spec.name, spec.policy)
+            changes.append(f"bucket {spec.name} policy set")
+
+    configuration = _notification_configuration(
+        servertype, spec.notifications, await topic_arns
+    )
+    if _notification_set(dict(configuration)) != _notification_set(
+        current_notifications
+    ):
         await client.put_bucket_notification_configuration(
-            Bucket="transfer-inbox",
-            NotificationConfiguration=notification_config,
+            Bucket=spec.name,
+            NotificationConfiguration=configuration,
             SkipDestinationValidation=False,
         )
+        changes.append(f"bucket {spec.name} notifications set")
+    return changes
+
+
+async def main() -> int:
+    servertype: str = os.environ["S3_VENDOR"]
+    if servertype not in ("MinIO", "RadosGW"):
+        raise RuntimeError(f"Unsupported or missing S3_VENDOR: {servertype!r}")
+
+    spec = load_spec()
+    # topics, identity, and each bucket are independent, except that bucket
+    # notifications need the topic ARNs
+    topics = asyncio.create_task(reconcile_topics(servertype, spec.topics))
+    async with contextlib.AsyncExitStack() as stack:
+        client = await stack.enter_async_context(s3util.get_client("s3"))
+        tasks: dict[str, Awaitable[Any]] = {
+            "topics": topics,
+            "identity": reconcile_identity(servertype, spec.roles),
+        }
+        for bucket in spec.buckets:
+            tasks[f"bucket {bucket.name}"] = reconcile_bucket(
+                client, servertype, bucket, topics
+            )
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
 
-    return 0
+    changes: list[str] = []
+    failed = False
+    for name, result in zip(tasks, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Failed to reconcile {name}: {result!r}")
+            failed = True
+        elif isinstance(result, list):
+            changes.extend(result)
+    for change in changes:
+        logger.info(change)
+    if not changes and not failed:
+        logger.info("Cluster is up to date")
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
@@ -1,16 +1,29 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
-from . import auth
+from . import admission, auth, profiling, retention
 from .db import dbengine
-from .routers import items
+from .routers import files, ingest, items, presign
+from .storage import presign_client, s3_client
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await auth.account_provider.setup()
+    await s3_client.setup()
+    await presign_client.setup()
+    # the maintenance job should create them, this keeps items writable if not
+    partitions = asyncio.create_task(
+        retention.keep_partitions(
+            retention.ITEMS_PARTITIONS_AHEAD, retention.ITEMS_PARTITIONS_INTERVAL
+        )
+    )
     yield
+    partitions.cancel()
+    await presign_client.close()
+    await s3_client.close()
     await dbengine.dispose()
 
 
@@ -20,7 +33,13 @@ app = FastAPI(
     lifespan=lifespan,
 )
 app.include_router(items.router)
+app.include_router(presign.router)
+app.include_router(ingest.router)
+app.include_router(files.router)
 app.include_router(auth.router)
+app.include_router(admission.router)
+app.include_router(profiling.router)
+app.add_middleware(profiling.ProfilingMiddleware)
 
 
 @app.get("/")
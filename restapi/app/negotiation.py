@@ -0,0 +1,138 @@
+import json
+import os
+import zlib
+from typing import AsyncGenerator, Callable, Coroutine
+
+import msgpack
+import zstandard
+from fastapi import HTTPException, Request, Response, status
+from fastapi.routing import APIRoute
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_ZSTD_LEVEL = int(os.environ.get("COMPRESS_ZSTD_LEVEL", "3"))
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", "5"))
+
+
+def _media_types(header: str) -> dict[str, float]:
+    """Media types or codings of an Accept style header, with their quality"""
+    accepted = {}
+    for part in header.split(","):
+        value, *params = (p.strip() for p in part.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, q = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0.0
+        if value:
+            accepted[value.lower()] = quality
+    return accepted
+
+
+def _accepts_msgpack(request: Request) -> bool:
+    accepted = _media_types(request.headers.get("accept", ""))
+    msgpack_q = max(accepted.get(t, 0.0) for t in MSGPACK_MEDIA_TYPES)
+    return msgpack_q > 0 and msgpack_q >= accepted.get("application/json", 0.0)
+
+
+def _response_coding(request: Request) -> str | None:
+    accepted = _media_types(request.headers.get("accept-encoding", ""))
+    for coding in ("zstd", "gzip"):
+        if accepted.get(coding, 0.0) > 0:
+            return coding
+    return None
+
+
+def _decompressor(coding: str | None) -> Callable[[bytes], bytes] | None:
+    if coding == "zstd":
+        decompressor = zstandard.ZstdDecompressor()
+        return decompressor.decompressobj(read_across_frames=True).decompress
+    if coding == "gzip":
+        return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16).decompress
+    return None
+
+
+def _compress(body: bytes, coding: str) -> bytes:
+    if coding == "zstd":
+        return zstandard.ZstdCompressor(level=COMPRESS_ZSTD_LEVEL).compress(body)
+    compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, wbits=zlib.MAX_WBITS | 16)
+    return compressor.compress(body) + compressor.flush()
+
+
+class NegotiatedRequest(Request):
+    """Request with a compressed or MessagePack body decoded on read
+
+    MessagePack bodies are presented with a JSON content type, so that
+    FastAPI reads them through json(), which decodes MessagePack instead
+    """
+
+    def __init__(self, request: Request):
+        self.content_coding = request.headers.get("content-encoding", "identity")
+        if self.content_coding not in ("identity", "zstd", "gzip"):
+            raise HTTPException(
+                status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail=f"Unsupported Content-Encoding {self.content_coding}",
+            )
+        content_type = request.headers.get("content-type", "").split(";")[0]
+        self.msgpack_body = content_type.strip() in MSGPACK_MEDIA_TYPES
+        # the body is decoded here, the route only sees the decoded form
+        headers = []
+        for key, value in request.scope["headers"]:
+            if key == b"content-encoding":
+                continue
+            if key == b"content-type" and self.msgpack_body:
+                value = b"application/json"
+            headers.append((key, value))
+        super().__init__(request.scope | {"headers": headers}, request.receive)
+
+    async def stream(self) -> AsyncGenerator[bytes, None]:
+        decompress = _decompressor(self.content_coding)
+        async for chunk in super().stream():
+            if decompress and chunk:
+                chunk = decompress(chunk)
+            if chunk:
+                yield chunk
+
+    async def json(self):
+        if not self.msgpack_body:
+            return await super().json()
+        if not hasattr(self, "_json"):
+            self._json = msgpack.unpackb(await self.body())
+        return self._json
+
+
+class NegotiatedRoute(APIRoute):
+    """Route accepting and sending MessagePack and compressed bodies
+
+    Request bodies may be sent as application/msgpack and with a zstd or gzip
+    Content-Encoding. Responses are converted to MessagePack for clients that
+    prefer it in Accept, and compressed per Accept-Encoding once they reach
+    COMPRESS_MIN_SIZE bytes
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[None, None, Response]]:
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request) -> Response:
+            response = await handler(NegotiatedRequest(request))
+            # streaming responses have no body to convert
+            body = getattr(response, "body", None)
+            if not body or "content-encoding" in response.headers:
+                return response
+            if response.media_type == "application/json" and _accepts_msgpack(request):
+                body = msgpack.packb(json.loads(body))
+                response.headers["content-type"] = MSGPACK_MEDIA_TYPES[0]
+            response.headers.append("vary", "Accept, Accept-Encoding")
+            coding = _response_coding(request)
+            if coding and len(body) >= COMPRESS_MIN_SIZE:
+                body = _compress(body, coding)
+                response.headers["content-encoding"] = coding
+            response.body = body
+            response.headers["content-length"] = str(len(body))
+            return response
+
+        return negotiated_handler
@@ -0,0 +1,23 @@
+import base64
+import json
+from typing import Any
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(*values: Any) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, *types: type | tuple[type, ...]) -> list[Any]:
+    """Values of a cursor from encode_cursor, checked against types"""
+    malformed = HTTPException(status.HTTP_400_BAD_REQUEST, detail="Malformed cursor")
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise malformed
+    if not isinstance(values, list) or len(values) != len(types):
+        raise malformed
+    if not all(isinstance(value, type_) for value, type_ in zip(values, types)):
+        raise malformed
+    return values
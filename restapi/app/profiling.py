@@ -0,0 +1,173 @@
+import dataclasses
+import datetime
+import heapq
+import logging
+import os
+import random
+import time
+import uuid
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, status
+from fastapi.responses import HTMLResponse, Response
+from fastapi.security import SecurityScopes
+from pyinstrument import Profiler
+from pyinstrument.renderers import HTMLRenderer, SpeedscopeRenderer
+from pyinstrument.session import Session
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .auth import (
+    Administrator,
+    account_provider,
+    administrator,
+    authorized_user,
+    valid_token,
+)
+from .shared.models.profile import ProfileOut
+
+logger = logging.getLogger(__name__)
+
+# Admins profile a request by sending the header or query parameter, with
+# value "speedscope" for speedscope JSON instead of the HTML flame graph
+PROFILE_HEADER = "x-profile"
+PROFILE_QUERY = "profile"
+PROFILE_MAX_CONCURRENT = int(os.environ.get("PROFILE_MAX_CONCURRENT", "2"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.001"))
+# Fraction of all requests profiled in the background, of which the slowest
+# PROFILE_KEEP are kept for GET /profiles
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "20"))
+
+
+@dataclasses.dataclass(order=True)
+class StoredProfile:
+    duration: float
+    info: ProfileOut = dataclasses.field(compare=False)
+    session: Session = dataclasses.field(compare=False)
+
+
+class SlowestProfiles:
+    """Keeps the size slowest profiles, replacing the fastest when full"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._heap: list[StoredProfile] = []
+
+    def add(self, profile: StoredProfile):
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, profile)
+        elif self._heap and profile > self._heap[0]:
+            heapq.heapreplace(self._heap, profile)
+
+    def list(self) -> list[StoredProfile]:
+        return sorted(self._heap, reverse=True)
+
+    def get(self, profile_id: str) -> StoredProfile | None:
+        return next((p for p in self._heap if p.info.id == profile_id), None)
+
+
+slowest_profiles = SlowestProfiles(PROFILE_KEEP)
+
+
+async def _is_administrator(request: Request) -> bool:
+    try:
+        # the dependencies of Administrator, resolved by hand
+        authorization = await account_provider(request)
+        token = await valid_token(SecurityScopes(), authorization, authorization)
+        await administrator(await authorized_user(token, BackgroundTasks()))
+    except HTTPException:
+        return False
+    return True
+
+
+def _render(session: Session, output: str) -> Response:
+    if output == "speedscope":
+        return Response(
+            SpeedscopeRenderer().render(session), media_type="application/json"
+        )
+    return HTMLResponse(HTMLRenderer().render(session))
+
+
+class ProfilingMiddleware:
+    """Profiles requests with a sampling profiler
+
+    A request flagged by an administrator is answered with its profile instead
+    of the response. With PROFILE_SAMPLE_RATE set, a random fraction of all
+    requests is profiled too and the slowest kept. At most
+    PROFILE_MAX_CONCURRENT requests are profiled at a time, others run as usual
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._active = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request = Request(scope)
+        output = request.headers.get(PROFILE_HEADER) or request.query_params.get(
+            PROFILE_QUERY
+        )
+        sampled = random.random() < PROFILE_SAMPLE_RATE
+        if not (output or sampled) or self._active >= PROFILE_MAX_CONCURRENT:
+            return await self.app(scope, receive, send)
+        if output and not await _is_administrator(request):
+            return await self.app(scope, receive, send)
+
+        status_code = None
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            if not output:
+                await send(message)
+
+        self._active += 1
+        profiler = Profiler(interval=PROFILE_INTERVAL, async_mode="enabled")
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            session = profiler.stop()
+            self._active -= 1
+        duration = time.perf_counter() - start
+
+        info = ProfileOut(
+            id=uuid.uuid4().hex,
+            method=request.method,
+            path=request.url.path,
+            status_code=status_code,
+            duration=duration,
+            time=datetime.datetime.now(tz=datetime.timezone.utc),
+        )
+        if output:
+            logger.info(f"Profiled {info.method} {info.path} in {duration:.3f}s")
+            response = _render(session, output)
+            if status_code:
+                response.headers["X-Profiled-Status"] = str(status_code)
+            await response(scope, receive, send)
+        else:
+            slowest_profiles.add(StoredProfile(duration, info, session))
+
+
+router = APIRouter(
+    prefix="/profiles",
+    tags=["profiles"],
+)
+
+
+@router.get("/", response_model=list[ProfileOut])
+async def read_profiles(user: Administrator):
+    """The slowest sampled requests, slowest first"""
+    return [profile.info for profile in slowest_profiles.list()]
+
+
+@router.get("/{profile_id}")
+async def read_profile(
+    profile_id: str, user: Administrator, output: str = "html"
+) -> Response:
+    profile = slowest_profiles.get(profile_id)
+    if not profile:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="No profile")
+    return _render(profile.session, output)
@@ -0,0 +1,99 @@
+import datetime
+import logging
+import os
+import time
+
+from fastapi import BackgroundTasks
+
+from .db import User, session_factory
+from .shared import s3util
+from .shared.models.user import CurrentUser
+
+logger = logging.getLogger(__name__)
+
+USER_PROVISIONING = os.environ.get("USER_PROVISIONING", "true").lower() == "true"
+# Seconds before provisioning a subject is tried again after a failure
+PROVISIONING_RETRY_DELAY = float(os.environ.get("PROVISIONING_RETRY_DELAY", "60"))
+
+
+async def provision_storage(user: CurrentUser):
+    """Create the personal bucket of user and, on RadosGW, the role to access it
+
+    Both calls are idempotent, and fail if the bucket or role already exists
+    for someone else
+    """
+    assert user.bucket is not None
+    async with s3util.get_client("s3") as client:
+        await s3util.create_owned_bucket(client, user.bucket, user.sub)
+    # MinIO roles are configured through its environment instead
+    if os.environ["S3_VENDOR"] == "RadosGW":
+        oidc_provider_arn = s3util.oidc_provider_arn_for(os.environ["OIDC_PROVIDER"])
+        async with s3util.get_client("iam") as client:
+            await s3util.create_oidc_role(
+                client, oidc_provider_arn, user.bucket, user.sub
+            )
+
+
+class UserProvisioner:
+    """Provisions storage for each subject once, in the background
+
+    Subjects known to be provisioned are remembered in process, so only the
+    first request of a subject (per process) looks at the users table. At most
+    one provisioning runs per subject at a time
+    """
+
+    def __init__(self):
+        self._provisioned: set[str] = set()
+        self._pending: set[str] = set()
+        # subjects whose username makes no valid bucket name
+        self._rejected: set[str] = set()
+        # subject -> time.monotonic() before which not to retry
+        self._backoff: dict[str, float] = {}
+
+    def schedule(self, user: CurrentUser, background_tasks: BackgroundTasks):
+        """Provision user after the response, unless already done or failing"""
+        if user.sub in self._provisioned or user.sub in self._pending:
+            return
+        if user.bucket is None:
+            # not retried, the username stays invalid
+            if user.sub not in self._rejected:
+                logger.warning(f"No valid bucket name for {user.username!r}")
+                self._rejected.add(user.sub)
+            return
+        if self._backoff.get(user.sub, 0.0) > time.monotonic():
+            return
+        background_tasks.add_task(self.provision, user)
+
+    async def provision(self, user: CurrentUser):
+        # concurrent first requests may each have scheduled this
+        if user.sub in self._provisioned or user.sub in self._pending:
+            return
+        self._pending.add(user.sub)
+        try:
+            async with session_factory() as session:
+                dbuser = await session.get(User, user.sub)
+                if dbuser is None or dbuser.provisioned_at is None:
+                    await provision_storage(user)
+                    await session.merge(
+                        User(
+                            id=user.sub,
+                            username=user.username,
+                            email=user.email,
+                            name=user.name,
+                            provisioned_at=datetime.datetime.now(
+                                tz=datetime.timezone.utc
+                            ),
+                        )
+                    )
+                    await session.commit()
+                    logger.info(f"Provisioned storage for {user.username}")
+            self._provisioned.add(user.sub)
+            self._backoff.pop(user.sub, None)
+        except Exception:
+            logger.exception(f"Failed to provision storage for {user.username}")
+            self._backoff[user.sub] = time.monotonic() + PROVISIONING_RETRY_DELAY
+        finally:
+            self._pending.discard(user.sub)
+
+
+user_provisioner = UserProvisioner()
@@ -0,0 +1,232 @@
+"""Partition maintenance and retention for items
+
+items is partitioned by month of create_date (UTC), see the
+partition_items_by_create_date migration.
+
+python -m app.retention maintain
+    Creates partitions up to ITEMS_PARTITIONS_AHEAD months ahead and, if
+    ITEMS_RETENTION_DAYS is set, detaches or drops (ITEMS_RETENTION_ACTION)
+    the partitions entirely older than that. Runs on every deploy and
+    should also run periodically, e.g. daily. There is no default
+    partition, items cannot be created once the partitions run out, so the
+    restapi also creates them (every ITEMS_PARTITIONS_INTERVAL seconds).
+
+python -m app.retention purge OWNER_ID [--before DATE]
+    Deletes an owner's items in batches, at a limited rate.
+"""
+
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import re
+import time
+
+from sqlalchemy import delete, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .db import Item, dbengine
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"items_p(\d{4})(\d{2})")
+ITEMS_PARTITIONS_AHEAD = int(os.environ.get("ITEMS_PARTITIONS_AHEAD", "3"))
+ITEMS_PARTITIONS_INTERVAL = float(
+    os.environ.get("ITEMS_PARTITIONS_INTERVAL", str(24 * 3600))
+)
+
+# Dropping a partition does not fire the delete triggers that maintain
+# item_stats, so its rows are subtracted here. Partitions are dropped oldest
+# first, so a group's latest item is usually in a later one.
+SUBTRACT_ITEM_STATS = """
+UPDATE item_stats AS s
+SET
+    count = s.count - r.count,
+    data_size = s.data_size - r.data_size,
+    latest_create_date = CASE
+        WHEN s.latest_create_date >= :upper THEN s.latest_create_date
+        ELSE coalesce((
+            SELECT max(i.create_date) FROM items AS i
+            WHERE i.owner_id = s.owner_id AND i.type = s.type
+        ), s.latest_create_date)
+    END
+FROM (
+    SELECT
+        owner_id,
+        type,
+        count(*) AS count,
+        sum(octet_length(data::text)) AS data_size
+    FROM {partition}
+    GROUP BY owner_id, type
+    ORDER BY owner_id, type
+) AS r
+WHERE s.owner_id = r.owner_id AND s.type = r.type
+"""
+
+
+async def create_partitions(conn: AsyncConnection, months_ahead: int) -> list[str]:
+    # restapi replicas and the maintenance job may run this concurrently
+    await conn.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext('items_partitions'))")
+    )
+    # creating a partition locks out all queries on items while it waits
+    await conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+    result = await conn.execute(
+        text(
+            "SELECT create_item_partitions("
+            "now(), now() + make_interval(months => :months))"
+        ),
+        {"months": months_ahead},
+    )
+    return list(result.scalars())
+
+
+async def keep_partitions(months_ahead: int, interval: float):
+    """Create upcoming partitions now and then every interval seconds"""
+    while True:
+        try:
+            async with dbengine.begin() as conn:
+                if created := await create_partitions(conn, months_ahead):
+                    logger.info(f"Created partitions: {created}")
+        except Exception:
+            logger.exception("Failed to create items partitions")
+        await asyncio.sleep(interval)
+
+
+async def list_partitions(conn: AsyncConnection) -> list[tuple[str, datetime.datetime]]:
+    """Monthly partitions of items and their (exclusive) upper bounds"""
+    result = await conn.execute(text("""
+            SELECT c.relname FROM pg_inherits AS i
+            JOIN pg_class AS c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'items'::regclass
+            """))
+    partitions = []
+    for name in result.scalars():
+        if match := PARTITION_NAME.fullmatch(name):
+            year, month = int(match[1]), int(match[2])
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            upper = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+            partitions.append((name, upper))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+async def expire_partition(
+    conn: AsyncConnection, name: str, upper: datetime.datetime, drop: bool
+):
+    # DETACH locks out all queries on items while it waits for its lock
+    await conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+    await conn.execute(text(f'ALTER TABLE items DETACH PARTITION "{name}"'))
+    await conn.execute(
+        text(SUBTRACT_ITEM_STATS.format(partition=f'"{name}"')), {"upper": upper}
+    )
+    await conn.execute(text("DELETE FROM item_stats WHERE count <= 0"))
+    if drop:
+        await conn.execute(text(f'DROP TABLE "{name}"'))
+
+
+async def maintain(
+    months_ahead: int, retention_days: int | None, drop: bool = False
+) -> int:
+    async with dbengine.begin() as conn:
+        created = await create_partitions(conn, months_ahead)
+        partitions = await list_partitions(conn)
+    logger.info(f"Created partitions: {created}")
+    if retention_days is None:
+        return 0
+
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        days=retention_days
+    )
+    for name, upper in partitions:
+        if upper > cutoff:
+            break
+        # one partition per transaction, to hold the lock briefly
+        async with dbengine.begin() as conn:
+            await expire_partition(conn, name, upper, drop)
+        logger.info(f"{'Dropped' if drop else 'Detached'} partition {name}")
+    return 0
+
+
+async def purge_owner(
+    owner_id: str,
+    before: datetime.datetime | None,
+    batch_size: int,
+    rows_per_second: float,
+) -> int:
+    """Delete an owner's items (created before before), batch by batch
+
+    Each batch is its own transaction, so locks and the item_stats update
+    stay small, and batches are paced to at most rows_per_second
+    Returns the number of items deleted
+    """
+    if rows_per_second <= 0:
+        raise ValueError(f"rows_per_second must be positive, not {rows_per_second}")
+    batch = select(Item.id, Item.create_date).where(Item.owner_id == owner_id)
+    if before is not None:
+        # also prunes the partitions that cannot match
+        batch = batch.where(Item.create_date < before)
+    statement = delete(Item).where(
+        tuple_(Item.id, Item.create_date).in_(batch.limit(batch_size))
+    )
+    total = 0
+    while True:
+        start = time.monotonic()
+        async with dbengine.begin() as conn:
+            deleted = (await conn.execute(statement)).rowcount
+        total += deleted
+        logger.info(f"Deleted {total} items of {owner_id}")
+        if deleted < batch_size:
+            return total
+        await asyncio.sleep(batch_size / rows_per_second - (time.monotonic() - start))
+
+
+def _datetime(value: str) -> datetime.datetime:
+    result = datetime.datetime.fromisoformat(value)
+    if result.tzinfo is None:
+        return result.replace(tzinfo=datetime.timezone.utc)
+    return result
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("maintain", help="Create and expire partitions")
+    purge = commands.add_parser("purge", help="Delete an owner's items")
+    purge.add_argument("owner_id", help="Subject of the owner")
+    purge.add_argument("--before", type=_datetime, help="ISO date, UTC if naive")
+    purge.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.environ.get("ITEMS_PURGE_BATCH_SIZE", "1000")),
+    )
+    purge.add_argument(
+        "--rows-per-second",
+        type=float,
+        default=float(os.environ.get("ITEMS_PURGE_ROWS_PER_SECOND", "5000")),
+    )
+    args = parser.parse_args()
+
+    try:
+        if args.command == "maintain":
+            action = os.environ.get("ITEMS_RETENTION_ACTION", "detach")
+            if action not in ("detach", "drop"):
+                raise RuntimeError(f"Unsupported ITEMS_RETENTION_ACTION: {action!r}")
+            retention_days = os.environ.get("ITEMS_RETENTION_DAYS")
+            return await maintain(
+                ITEMS_PARTITIONS_AHEAD,
+                int(retention_days) if retention_days else None,
+                drop=action == "drop",
+            )
+        await purge_owner(
+            args.owner_id, args.before, args.batch_size, args.rows_per_second
+        )
+        return 0
+    finally:
+        await dbengine.dispose()
+
+
+if __name__ == "__main__":
+    logger.setLevel(logging.DEBUG)
+    logging.basicConfig(level=logging.INFO)
+    exit(asyncio.run(main()))
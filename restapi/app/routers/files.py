@@ -0,0 +1,167 @@
+import datetime
+import os
+from typing import Annotated
+
+from fastapi import APIRouter, HTTPException, Query, status
+from sqlalchemy import and_, func, literal_column, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from ..admission import Reads, Writes
+from ..auth import AuthorizedUser, IngestUser
+from ..db import DBSession, File
+from ..negotiation import NegotiatedRoute
+from ..pagination import decode_cursor, encode_cursor
+from ..shared.models.file import (
+    FileIn,
+    FileLookupIn,
+    FileOut,
+    FileRef,
+    FileStatus,
+)
+from ..shared.models.page import Page
+
+# Seconds after which a conversion that has not finished is presumed dead,
+# e.g. its consumer crashed, and the file counts as missing again
+FILES_CONVERTING_TIMEOUT = float(os.environ.get("FILES_CONVERTING_TIMEOUT", "21600"))
+
+router = APIRouter(
+    prefix="/files",
+    tags=["files"],
+    route_class=NegotiatedRoute,
+)
+
+
+def _sees_all(user: AuthorizedUser) -> bool:
+    # otherwise users only see the files of their personal bucket
+    return "admin" in user.scopes or "ingest" in user.scopes
+
+
+def _prefix_upper_bound(prefix: str) -> str | None:
+    """Smallest string greater than all strings starting with prefix
+
+    text_pattern_ops compares UTF-8 bytes, which sorts like code points
+    """
+    while prefix:
+        last = ord(prefix[-1]) + 1
+        if 0xD800 <= last <= 0xDFFF:
+            last = 0xE000
+        if last <= 0x10FFFF:
+            return prefix[:-1] + chr(last)
+        prefix = prefix[:-1]
+    return None
+
+
+@router.get("/", response_model=Page[FileOut], dependencies=[Reads])
+async def read_files(
+    session: DBSession,
+    user: AuthorizedUser,
+    prefix: str = "",
+    bucket: str | None = None,
+    file_status: Annotated[list[FileStatus] | None, Query(alias="status")] = None,
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+):
+    # Range conditions rather than LIKE, so that the text_pattern_ops index
+    # is also usable from a generic prepared statement plan
+    statement = select(File)
+    if not _sees_all(user):
+        statement = statement.where(File.bucket == user.bucket)
+    if prefix:
+        statement = statement.where(File.key.op("~>=~")(prefix))
+        upper = _prefix_upper_bound(prefix)
+        if upper is not None:
+            statement = statement.where(File.key.op("~<~")(upper))
+    if bucket is not None:
+        statement = statement.where(File.bucket == bucket)
+    if file_status:
+        statement = statement.where(File.status.in_(file_status))
+    if cursor is not None:
+        last_key, last_id = decode_cursor(cursor, str, int)
+        statement = statement.where(
+            or_(
+                File.key.op("~>~")(last_key),
+                and_(File.key == last_key, File.id > last_id),
+            )
+        )
+    statement = statement.order_by(
+        literal_column("files.key USING ~<~"), File.id
+    ).limit(limit + 1)
+    files = [
+        FileOut.model_validate(file) for (file,) in await session.execute(statement)
+    ]
+    next_cursor = None
+    if len(files) > limit:
+        files = files[:limit]
+        next_cursor = encode_cursor(files[-1].key, files[-1].id)
+    return Page[FileOut](items=files, next_cursor=next_cursor)
+
+
+@router.post("/missing", response_model=list[FileRef], dependencies=[Reads])
+async def read_missing_files(
+    session: DBSession, lookup: FileLookupIn, user: AuthorizedUser
+):
+    """Return the files that were not ingested, or were with another etag
+
+    Files whose conversion failed count as not ingested, as do files that
+    have been converting for longer than FILES_CONVERTING_TIMEOUT. Files
+    converting more recently are left to the consumer converting them
+    """
+    if not lookup.files:
+        return []
+    if not _sees_all(user):
+        for ref in lookup.files:
+            if ref.bucket != user.bucket:
+                raise HTTPException(
+                    status.HTTP_403_FORBIDDEN,
+                    detail=f"No access to bucket {ref.bucket}",
+                )
+    stale = func.now() - datetime.timedelta(seconds=FILES_CONVERTING_TIMEOUT)
+    statement = select(File.bucket, File.key, File.etag).where(
+        tuple_(File.bucket, File.key).in_(
+            [(ref.bucket, ref.key) for ref in lookup.files]
+        ),
+        or_(
+            File.status == "done",
+            and_(File.status == "converting", File.update_date > stale),
+        ),
+    )
+    # Listings quote the etag, notifications may not
+    known = {
+        (bucket, key): etag.strip('"')
+        for bucket, key, etag in await session.execute(statement)
+    }
+    return [
+        ref
+        for ref in lookup.files
+        if known.get((ref.bucket, ref.key)) != ref.etag.strip('"')
+    ]
+
+
+@router.get("/{bucket}/{key:path}", response_model=FileOut, dependencies=[Reads])
+async def read_file(session: DBSession, bucket: str, key: str, user: AuthorizedUser):
+    if not _sees_all(user) and bucket != user.bucket:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="No file")
+    statement = select(File).where(File.bucket == bucket, File.key == key)
+    file = (await session.execute(statement)).scalar_one_or_none()
+    if not file:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="No file")
+    return FileOut.model_validate(file)
+
+
+@router.put("/{bucket}/{key:path}", response_model=FileOut, dependencies=[Writes])
+async def register_file(
+    session: DBSession, bucket: str, key: str, file_in: FileIn, user: IngestUser
+):
+    values = file_in.model_dump(exclude_unset=True)
+    statement = (
+        insert(File)
+        .values(bucket=bucket, key=key, **values)
+        .on_conflict_do_update(
+            index_elements=[File.bucket, File.key],
+            set_=values | {"update_date": func.now()},
+        )
+        .returning(File)
+    )
+    file = (await session.execute(statement)).scalar_one()
+    await session.commit()
+    return FileOut.model_validate(file)
@@ -0,0 +1,82 @@
+import json
+import os
+from contextlib import asynccontextmanager
+
+from aio_pika import connect
+from aio_pika.abc import AbstractIncomingMessage, AbstractQueue
+from fastapi import APIRouter
+
+from ..admission import Reads, Writes
+from ..auth import Administrator
+from ..shared import amqputil
+from ..shared.models.ingest import DeadLetterOut, ReplayIn, ReplayOut
+
+AMQP_URL = os.environ["AMQP_URL"]
+AMQP_EXCHANGE = os.environ["AMQP_EXCHANGE"]
+AMQP_TRANSFER_TOPIC = os.environ["AMQP_TRANSFER_TOPIC"]
+
+router = APIRouter(
+    prefix="/ingest",
+    tags=["ingest"],
+)
+
+
+@asynccontextmanager
+async def _dead_letter_queue():
+    connection = await connect(AMQP_URL)
+    async with connection:
+        channel = await connection.channel()
+        queue = await channel.declare_queue(
+            amqputil.dead_letter_queue_name(AMQP_TRANSFER_TOPIC), durable=True
+        )
+        yield channel, queue
+        # closing the channel returns all unacknowledged messages to the queue
+
+
+async def _fetch(queue: AbstractQueue, limit: int) -> list[AbstractIncomingMessage]:
+    # Messages are held unacknowledged so each is only fetched once
+    messages: list[AbstractIncomingMessage] = []
+    while len(messages) < limit:
+        message = await queue.get(fail=False)
+        if message is None:
+            break
+        messages.append(message)
+    return messages
+
+
+def _dead_letter_out(message: AbstractIncomingMessage) -> DeadLetterOut:
+    try:
+        event = json.loads(message.body)
+    except ValueError:
+        event = message.body.decode(errors="replace")
+    error = message.headers.get(amqputil.ERROR_HEADER)
+    return DeadLetterOut(
+        message_id=message.message_id,
+        attempts=amqputil.attempts(message),
+        error=None if error is None else str(error),
+        timestamp=message.timestamp,
+        event=event,
+    )
+
+
+@router.get("/dead-letters", response_model=list[DeadLetterOut], dependencies=[Reads])
+async def read_dead_letters(user: Administrator, limit: int = 100):
+    async with _dead_letter_queue() as (_, queue):
+        messages = await _fetch(queue, limit)
+        return [_dead_letter_out(message) for message in messages]
+
+
+@router.post("/dead-letters/replay", response_model=ReplayOut, dependencies=[Writes])
+async def replay_dead_letters(user: Administrator, replay_in: ReplayIn):
+    replayed = []
+    async with _dead_letter_queue() as (channel, queue):
+        for message in await _fetch(queue, replay_in.limit):
+            if (
+                replay_in.message_ids is not None
+                and message.message_id not in replay_in.message_ids
+            ):
+                continue
+            await amqputil.replay(channel, AMQP_EXCHANGE, AMQP_TRANSFER_TOPIC, message)
+            await message.ack()
+            replayed.append(message.message_id)
+    return ReplayOut(replayed=replayed)
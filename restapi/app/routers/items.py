@@ -1,32 +1,131 @@
 import datetime
-from fastapi import APIRouter, HTTPException, status
-from sqlalchemy import select
+from typing import Annotated, AsyncIterator
+
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from pydantic import ValidationError
+from sqlalchemy import (
+    and_,
+    cast,
+    delete,
+    func,
+    insert,
+    literal,
+    literal_column,
+    or_,
+    select,
+)
+from sqlalchemy.dialects.postgresql import JSONB, REGCONFIG
 from sqlalchemy.orm import selectinload
 
-from ..auth import AuthorizedUser
-from ..db import DBSession, Item, User
-from ..shared.models.item import ItemIn, ItemOut
+from ..admission import Reads, Streams, Writes
+from ..auth import AuthorizedUser, IngestUser
+from ..db import DBSession, Item, ItemStats, User
+from ..negotiation import NegotiatedRoute
+from ..pagination import decode_cursor, encode_cursor
+from ..shared.models.item import ItemIn, ItemOut, ItemStatsOut, ItemStreamSummary
+from ..shared.models.page import Page
 
 router = APIRouter(
     prefix="/items",
     tags=["items"],
+    route_class=NegotiatedRoute,
 )
 
 
-@router.get("/", response_model=list[ItemOut])
+# items is partitioned by create_date, bounding it skips whole partitions
+Since = Annotated[
+    datetime.datetime | None, Query(description="Only items created at or after")
+]
+Until = Annotated[
+    datetime.datetime | None, Query(description="Only items created before")
+]
+
+
+def _created_between(statement, since: Since, until: Until):
+    if since is not None:
+        statement = statement.where(Item.create_date >= since)
+    if until is not None:
+        statement = statement.where(Item.create_date < until)
+    return statement
+
+
+@router.get("/", response_model=list[ItemOut], dependencies=[Reads])
 async def read_items(
-    session: DBSession, user: AuthorizedUser, offset: int = 0, limit: int = 100
+    session: DBSession,
+    user: AuthorizedUser,
+    offset: int = 0,
+    limit: int = 100,
+    since: Since = None,
+    until: Until = None,
 ):
     if "admin" in user.scopes:
         statement = select(Item)
     else:
         statement = select(Item).where(Item.owner_id == user.sub)
+    statement = _created_between(statement, since, until)
     statement = statement.offset(offset).limit(limit).options(selectinload(Item.owner))
     rows = await session.execute(statement)
     items = [ItemOut.model_validate(item) for (item,) in rows]
     return items
 
 
+@router.get("/search", response_model=Page[ItemOut], dependencies=[Reads])
+async def search_items(
+    session: DBSession,
+    user: AuthorizedUser,
+    q: Annotated[
+        str,
+        Query(
+            min_length=1,
+            description='Words in the type or data, "quoted phrases", or, -word',
+        ),
+    ],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    since: Since = None,
+    until: Until = None,
+):
+    """Items matching q, best match first"""
+    query = func.websearch_to_tsquery(cast("simple", REGCONFIG), q)
+    rank = func.ts_rank(Item.search, query)
+    statement = select(Item, rank).where(Item.search.bool_op("@@")(query))
+    if "admin" not in user.scopes:
+        statement = statement.where(Item.owner_id == user.sub)
+    statement = _created_between(statement, since, until)
+    if cursor is not None:
+        last_rank, last_id = decode_cursor(cursor, (int, float), int)
+        statement = statement.where(
+            or_(rank < last_rank, and_(rank == last_rank, Item.id < last_id))
+        )
+    statement = (
+        statement.order_by(rank.desc(), Item.id.desc())
+        .limit(limit + 1)
+        .options(selectinload(Item.owner))
+    )
+    rows = (await session.execute(statement)).all()
+    items = [ItemOut.model_validate(item) for item, _ in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        item, item_rank = rows[limit - 1]
+        next_cursor = encode_cursor(item_rank, item.id)
+    return Page[ItemOut](items=items, next_cursor=next_cursor)
+
+
+@router.get("/stats", response_model=list[ItemStatsOut], dependencies=[Reads])
+async def read_item_stats(
+    session: DBSession, user: AuthorizedUser, type: str | None = None
+):
+    """Item count, data size and latest creation per owner and type"""
+    statement = select(ItemStats)
+    if "admin" not in user.scopes:
+        statement = statement.where(ItemStats.owner_id == user.sub)
+    if type is not None:
+        statement = statement.where(ItemStats.type == type)
+    statement = statement.order_by(ItemStats.owner_id, ItemStats.type)
+    rows = await session.execute(statement)
+    return [ItemStatsOut.model_validate(stats) for (stats,) in rows]
+
+
 async def _get_item(session: DBSession, item_id: int, user: AuthorizedUser) -> Item:
     item = await session.get(Item, item_id, options=(selectinload(Item.owner),))
     if not item:
@@ -38,12 +137,86 @@ async def _get_item(session: DBSession, item_id: int, user: AuthorizedUser) -> I
     )  # alt. not authorized
 
 
-@router.get("/{item_id}", response_model=ItemOut)
+STREAM_BATCH_SIZE = 500
+STREAM_MAX_ERRORS = 10
+
+
+async def _lines(request: Request) -> AsyncIterator[bytes]:
+    buffer = b""
+    async for chunk in request.stream():
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line
+    yield buffer
+
+
+def _parse_line(line: bytes, summary: ItemStreamSummary) -> ItemIn | None:
+    try:
+        return ItemIn.model_validate_json(line)
+    except ValidationError as ex:
+        summary.failed += 1
+        if len(summary.errors) < STREAM_MAX_ERRORS:
+            summary.errors.append(str(ex))
+        return None
+
+
+async def _insert_batch(session: DBSession, owner_id: str, batch: list[ItemIn]) -> int:
+    rows = [{"owner_id": owner_id, **item_in.model_dump()} for item_in in batch]
+    await session.execute(insert(Item).values(rows))
+    return len(rows)
+
+
+@router.post("/stream", response_model=ItemStreamSummary, dependencies=[Streams])
+async def create_items_stream(
+    session: DBSession,
+    request: Request,
+    user: IngestUser,
+    bucket: Annotated[str, Query(description="Bucket of the file converted")],
+    key: Annotated[str, Query(description="Key of the file converted")],
+    etag: Annotated[str, Query(description="Version of the file converted")],
+):
+    """Create items from a newline-delimited JSON stream of ItemIn
+
+    The items are those of one file version, each item's data has a "file"
+    object with its bucket, key and etag. They replace the items of an earlier
+    stream for the same version, so retried conversions do not duplicate them.
+    Items are inserted with multi-row inserts as the stream arrives, all in one
+    transaction. Malformed lines are skipped and reported in the summary
+    """
+    await session.merge(
+        User(id=user.sub, username=user.username, email=user.email, name=user.name)
+    )
+    # written out (not a parameter) to match the ix_items_file index expression
+    item_file = cast(Item.data, JSONB).op("->")(literal_column("'file'"))
+    file = literal({"bucket": bucket, "key": key, "etag": etag}, JSONB)
+    await session.execute(
+        delete(Item)
+        .where(Item.owner_id == user.sub, item_file == file)
+        .execution_options(synchronize_session=False)
+    )
+    summary = ItemStreamSummary()
+    batch: list[ItemIn] = []
+    async for line in _lines(request):
+        if not line.strip():
+            continue
+        if item_in := _parse_line(line, summary):
+            batch.append(item_in)
+        if len(batch) >= STREAM_BATCH_SIZE:
+            summary.inserted += await _insert_batch(session, user.sub, batch)
+            batch = []
+    if batch:
+        summary.inserted += await _insert_batch(session, user.sub, batch)
+    await session.commit()
+    return summary
+
+
+@router.get("/{item_id}", response_model=ItemOut, dependencies=[Reads])
 async def read_item(session: DBSession, item_id: int, user: AuthorizedUser):
     return ItemOut.model_validate(await _get_item(session, item_id, user))
 
 
-@router.post("/", response_model=ItemOut)
+@router.post("/", response_model=ItemOut, dependencies=[Writes])
 async def create_item(session: DBSession, item_in: ItemIn, user: AuthorizedUser):
     dbuser = await session.merge(
         User(id=user.sub, username=user.username, email=user.email, name=user.name)
@@ -54,7 +227,7 @@ async def create_item(session: DBSession, item_in: ItemIn, user: AuthorizedUser)
     return ItemOut.model_validate(item)
 
 
-@router.put("/{item_id}", response_model=ItemOut)
+@router.put("/{item_id}", response_model=ItemOut, dependencies=[Writes])
 async def update_item(
     session: DBSession,
     item_in: ItemIn,
@@ -68,7 +241,7 @@ async def update_item(
     return ItemOut.model_validate(item)
 
 
-@router.delete("/{item_id}", response_model=ItemOut)
+@router.delete("/{item_id}", response_model=ItemOut, dependencies=[Writes])
 async def delete_item(session: DBSession, item_id: int, user: AuthorizedUser):
     item = await _get_item(session, item_id, user)
     await session.delete(item)
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+
+from fastapi import APIRouter, HTTPException, status
+
+from ..admission import Bulk
+from ..auth import AuthorizedUser
+from ..shared import s3util
+from ..shared.models.presign import PresignBatchIn, PresignOut, PresignRequest
+from ..storage import InternalClient, PresignClient
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/presign",
+    tags=["presign"],
+)
+
+
+def _check_access(request: PresignRequest, user: AuthorizedUser):
+    # Regular users may only transfer to and from their personal bucket
+    if "admin" in user.scopes or request.bucket == user.bucket:
+        return
+    raise HTTPException(
+        status.HTTP_403_FORBIDDEN, detail=f"No access to bucket {request.bucket}"
+    )
+
+
+async def _presign(
+    client: InternalClient,
+    signer: PresignClient,
+    request: PresignRequest,
+    expires_in: int,
+) -> PresignOut:
+    out = PresignOut(
+        bucket=request.bucket, key=request.key, operation=request.operation
+    )
+    if request.operation == "multipart":
+        assert request.size is not None
+        upload = await s3util.presign_multipart_upload(
+            client, request.bucket, request.key, request.size, expires_in, signer=signer
+        )
+        out.upload_id = upload.upload_id
+        out.part_size = upload.part_size
+        out.part_urls = upload.part_urls
+        out.complete_url = upload.complete_url
+        out.abort_url = upload.abort_url
+    else:
+        out.url = await s3util.presign_object(
+            signer, request.bucket, request.key, request.operation, expires_in
+        )
+    return out
+
+
+@router.post("/", response_model=list[PresignOut], dependencies=[Bulk])
+async def presign_objects(
+    client: InternalClient,
+    signer: PresignClient,
+    batch: PresignBatchIn,
+    user: AuthorizedUser,
+):
+    for request in batch.objects:
+        _check_access(request, user)
+    # Only multipart uploads make a request to the endpoint, everything else
+    # is signed locally, so it is cheap to run the whole batch concurrently
+    results = await asyncio.gather(
+        *(
+            _presign(client, signer, request, batch.expires_in)
+            for request in batch.objects
+        ),
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if not errors:
+        return results
+    # nobody would complete the uploads started for the rest of the batch
+    started = [
+        (result.bucket, result.key, result.upload_id)
+        for result in results
+        if isinstance(result, PresignOut) and result.upload_id is not None
+    ]
+    aborts = await asyncio.gather(
+        *(
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            for bucket, key, upload_id in started
+        ),
+        return_exceptions=True,
+    )
+    for (bucket, key, _), abort in zip(started, aborts):
+        if isinstance(abort, BaseException):
+            logger.error(f"Failed to abort upload of {bucket}/{key}: {abort}")
+    raise errors[0]
@@ -0,0 +1,50 @@
+import os
+from contextlib import AsyncExitStack
+from typing import TYPE_CHECKING, Annotated
+
+from fastapi import Depends
+
+from .shared import s3util
+
+if TYPE_CHECKING:
+    from types_aiobotocore_s3.client import S3Client
+
+
+class PooledS3Client:
+    """An S3 client (and its connection pool) shared by all requests"""
+
+    _stack: AsyncExitStack | None
+    _client: "S3Client | None"
+
+    def __init__(self, endpoint_url: str | None = None):
+        self.endpoint_url = endpoint_url
+        self._stack = None
+        self._client = None
+
+    async def setup(self):
+        self._stack = AsyncExitStack()
+        self._client = await self._stack.enter_async_context(
+            s3util.get_client("s3", endpoint_url=self.endpoint_url)
+        )
+
+    async def close(self):
+        if self._stack:
+            await self._stack.aclose()
+        self._stack = None
+        self._client = None
+
+    async def __call__(self) -> "S3Client":
+        if not self._client:
+            raise RuntimeError(
+                "S3 client not initialized! Make sure to call setup() in app lifespan"
+            )
+        return self._client
+
+
+# For requests the restapi itself makes to the endpoint
+s3_client = PooledS3Client()
+# URLs handed out to clients have to be signed for the externally visible endpoint
+presign_client = PooledS3Client(os.environ.get("S3_PUBLIC_ENDPOINT"))
+
+InternalClient = Annotated["S3Client", Depends(s3_client)]
+PresignClient = Annotated["S3Client", Depends(presign_client)]
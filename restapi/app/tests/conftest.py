@@ -62,3 +62,13 @@ def system_token_headers(client: TestClient) -> dict[str, str]:
     return auth_flow(
         username=SYSTEM_USERNAME, password=SYSTEM_PASSWORD, auth_client=client
     )
+
+
+@pytest.fixture(scope="module")
+def ingest_token_headers(client: TestClient) -> dict[str, str]:
+    return auth_flow(
+        username=SYSTEM_USERNAME,
+        password=SYSTEM_PASSWORD,
+        scopes=["ingest"],
+        auth_client=client,
+    )
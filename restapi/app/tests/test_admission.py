@@ -0,0 +1,23 @@
+from fastapi.testclient import TestClient
+
+
+def test_admission_metrics(
+    client: TestClient,
+    admin_token_headers: dict[str, str],
+    user_token_headers: dict[str, str],
+) -> None:
+    # an admitted request, so that the rate limiter has seen a subject
+    response = client.get("/items", headers=user_token_headers)
+    assert response.status_code == 200
+    response = client.get("/admission/metrics", headers=user_token_headers)
+    assert response.status_code == 401
+    response = client.get("/admission/metrics", headers=admin_token_headers)
+    assert response.status_code == 200
+    metrics = response.json()
+    assert {limiter["route_class"] for limiter in metrics["limiters"]} == {
+        "reads",
+        "writes",
+        "bulk",
+        "streams",
+    }
+    assert metrics["rate_limit"]["subjects"] >= 1
@@ -1,6 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
 
+from ..shared import s3util
 from ..shared.models.user import CurrentUser
 
 
@@ -18,6 +19,7 @@ def test_auth_secure(client: TestClient, user_token_headers) -> None:
     assert response.status_code == 200
     content = CurrentUser.model_validate_json(response.text)
     assert content.username == "test_readonly"
+    assert content.bucket == "user-test-readonly"
     response = client.get("/auth/admin", headers=user_token_headers)
     assert response.status_code == 401
 
@@ -27,3 +29,18 @@ def test_auth_system(client: TestClient, system_token_headers) -> None:
     assert response.status_code == 200
     content = CurrentUser.model_validate_json(response.text)
     assert content.name == "System User"
+    assert content.bucket is None
+
+
+@pytest.mark.parametrize(
+    "username, bucket",
+    [
+        ("alice", "user-alice"),
+        ("Bob_Smith", "user-bob-smith"),
+        ("carol.d@example.org", "user-carol-d-example-org"),
+        ("dave-", None),
+        ("e" * 60, None),
+    ],
+)
+def test_personal_bucket_name(username: str, bucket: str | None) -> None:
+    assert s3util.personal_bucket_name(username) == bucket
@@ -0,0 +1,131 @@
+import uuid
+from urllib.parse import quote
+
+from fastapi.testclient import TestClient
+
+from ..pagination import encode_cursor
+
+
+def test_files(
+    client: TestClient,
+    ingest_token_headers: dict[str, str],
+    admin_token_headers: dict[str, str],
+    user_token_headers: dict[str, str],
+) -> None:
+    file_in = {"size": 1234, "etag": '"abc"', "status": "converting"}
+    response = client.put(
+        "/files/test-bucket/dataset/a.root", json=file_in, headers=user_token_headers
+    )
+    assert response.status_code == 401
+    response = client.put(
+        "/files/test-bucket/dataset/a.root", json=file_in, headers=ingest_token_headers
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert content["key"] == "dataset/a.root"
+    assert content["keys"] is None
+
+    file_in["status"] = "done"
+    file_in["keys"] = [{"key": "Events", "class": "TTree"}]
+    response = client.put(
+        "/files/test-bucket/dataset/a.root", json=file_in, headers=ingest_token_headers
+    )
+    assert response.status_code == 200
+    assert response.json()["id"] == content["id"]
+    response = client.put(
+        "/files/test-bucket/dataset/b.root", json=file_in, headers=ingest_token_headers
+    )
+    assert response.status_code == 200
+
+    response = client.get(
+        "/files/test-bucket/dataset/a.root", headers=admin_token_headers
+    )
+    assert response.status_code == 200
+    assert response.json()["keys"] == file_in["keys"]
+
+    params = {"prefix": "dataset/", "bucket": "test-bucket", "limit": 1}
+    response = client.get("/files", params=params, headers=admin_token_headers)
+    assert response.status_code == 200
+    page = response.json()
+    assert [file["key"] for file in page["items"]] == ["dataset/a.root"]
+    params["cursor"] = page["next_cursor"]
+    page = client.get("/files", params=params, headers=admin_token_headers).json()
+    assert [file["key"] for file in page["items"]] == ["dataset/b.root"]
+
+    params = {"prefix": "dataset/", "status": "failed"}
+    page = client.get("/files", params=params, headers=admin_token_headers).json()
+    assert all(file["bucket"] != "test-bucket" for file in page["items"])
+
+    # users only see the files of their personal bucket
+    response = client.get(
+        "/files/test-bucket/dataset/a.root", headers=user_token_headers
+    )
+    assert response.status_code == 404
+    params = {"prefix": "dataset/", "bucket": "test-bucket"}
+    page = client.get("/files", params=params, headers=user_token_headers).json()
+    assert page["items"] == []
+    response = client.put(
+        "/files/user-test-readonly/dataset/a.root",
+        json=file_in,
+        headers=ingest_token_headers,
+    )
+    assert response.status_code == 200
+    page = client.get(
+        "/files", params={"prefix": "dataset/"}, headers=user_token_headers
+    ).json()
+    assert [(file["bucket"], file["key"]) for file in page["items"]] == [
+        ("user-test-readonly", "dataset/a.root")
+    ]
+    lookup = {"files": [{"bucket": "test-bucket", "key": "a", "etag": "abc"}]}
+    response = client.post("/files/missing", json=lookup, headers=user_token_headers)
+    assert response.status_code == 403
+
+    for cursor in (
+        "not base64!",
+        encode_cursor(),
+        encode_cursor("a"),
+        encode_cursor(1, 2),
+    ):
+        params = {"cursor": cursor}
+        response = client.get("/files", params=params, headers=user_token_headers)
+        assert response.status_code == 400
+
+    # keys are quoted in the path, as the ingest consumer does
+    key = "dataset/c #1?.root"
+    response = client.put(
+        f"/files/test-bucket/{quote(key)}", json=file_in, headers=ingest_token_headers
+    )
+    assert response.status_code == 200
+    assert response.json()["key"] == key
+
+
+def test_missing_files(
+    client: TestClient,
+    ingest_token_headers: dict[str, str],
+) -> None:
+    prefix = f"missing-{uuid.uuid4().hex}"
+    for name, status in (("done", "done"), ("busy", "converting"), ("bad", "failed")):
+        file_in = {"size": 1, "etag": '"abc"', "status": status}
+        response = client.put(
+            f"/files/test-bucket/{prefix}/{name}",
+            json=file_in,
+            headers=ingest_token_headers,
+        )
+        assert response.status_code == 200
+
+    files = [
+        {"bucket": "test-bucket", "key": f"{prefix}/{name}", "etag": etag}
+        for name, etag in (
+            ("done", "abc"),
+            ("busy", '"abc"'),
+            ("bad", "abc"),
+            ("done", "other"),
+            ("new", "abc"),
+        )
+    ]
+    response = client.post(
+        "/files/missing", json={"files": files}, headers=ingest_token_headers
+    )
+    assert response.status_code == 200
+    # recently started conversions are not missing, failed ones are
+    assert response.json() == files[2:]
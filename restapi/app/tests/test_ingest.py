@@ -0,0 +1,21 @@
+from fastapi.testclient import TestClient
+
+
+def test_dead_letters(
+    client: TestClient,
+    admin_token_headers: dict[str, str],
+    user_token_headers: dict[str, str],
+) -> None:
+    response = client.get("/ingest/dead-letters", headers=user_token_headers)
+    assert response.status_code == 401
+    response = client.get("/ingest/dead-letters", headers=admin_token_headers)
+    assert response.status_code == 200
+    assert isinstance(response.json(), list)
+
+    response = client.post(
+        "/ingest/dead-letters/replay",
+        json={"message_ids": ["does-not-exist"]},
+        headers=admin_token_headers,
+    )
+    assert response.status_code == 200
+    assert response.json()["replayed"] == []
@@ -1,5 +1,7 @@
 import json
+import uuid
 
+import msgpack
 from fastapi.testclient import TestClient
 
 
@@ -14,7 +16,7 @@ def test_crud_item(client: TestClient, admin_token_headers: dict[str, str]) -> N
     assert response.status_code == 422
 
     data = {"info": 3}
-    item_in["data"] = json.dumps(data)
+    item_in["data"] = data
     response = client.post("/items", json=item_in, headers=admin_token_headers)
     assert response.status_code == 200
     content = response.json()
@@ -38,7 +40,9 @@ def test_crud_item(client: TestClient, admin_token_headers: dict[str, str]) -> N
     assert content["type"] == item_in["type"]
     assert content["data"] == data
 
+    # the JSON text form is still accepted
     item_in["type"] = "cool"
+    item_in["data"] = json.dumps(data)
     response = client.put(
         f"/items/{item_id}", json=item_in, headers=admin_token_headers
     )
@@ -47,6 +51,7 @@ def test_crud_item(client: TestClient, admin_token_headers: dict[str, str]) -> N
     assert content["type"] == item_in["type"]
     content = client.get(f"/items/{item_id}", headers=admin_token_headers).json()
     assert content["type"] == item_in["type"]
+    assert content["data"] == data
 
     response = client.delete(f"/items/{item_id}")
     assert response.status_code == 401
@@ -54,3 +59,156 @@ def test_crud_item(client: TestClient, admin_token_headers: dict[str, str]) -> N
     assert response.status_code == 200
     response = client.get(f"/items/{item_id}", headers=admin_token_headers)
     assert response.status_code == 404
+
+
+def test_stream_items(
+    client: TestClient,
+    ingest_token_headers: dict[str, str],
+    admin_token_headers: dict[str, str],
+) -> None:
+    item_type = f"TTree-{uuid.uuid4().hex}"
+    file = {"bucket": "transfer-inbox", "key": f"{item_type}.root", "etag": "abc"}
+
+    def stream(count: int, headers: dict[str, str]):
+        lines = [
+            json.dumps({"type": item_type, "data": {"key": f"tree{i}", "file": file}})
+            for i in range(count)
+        ]
+        lines.insert(10, "not json")
+        body = "\n".join(lines).encode()
+        return client.post("/items/stream", params=file, content=body, headers=headers)
+
+    response = stream(1234, admin_token_headers)
+    assert response.status_code == 401
+    response = stream(1234, ingest_token_headers)
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["inserted"] == 1234
+    assert summary["failed"] == 1
+    assert len(summary["errors"]) == 1
+
+    # streaming the same file version again replaces its items
+    response = stream(20, ingest_token_headers)
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 20
+    response = client.get(
+        "/items/stats", params={"type": item_type}, headers=admin_token_headers
+    )
+    assert response.status_code == 200
+    assert [stats["count"] for stats in response.json()] == [20]
+
+
+def test_search_items(
+    client: TestClient,
+    admin_token_headers: dict[str, str],
+    user_token_headers: dict[str, str],
+) -> None:
+    word = uuid.uuid4().hex
+    item_ids = []
+    for i in range(3):
+        item_in = {"type": "searchable", "data": {"note": f"{word} {i}"}}
+        response = client.post("/items", json=item_in, headers=user_token_headers)
+        assert response.status_code == 200
+        item_ids.append(response.json()["id"])
+
+    found = []
+    cursor = None
+    while True:
+        params = {"q": word, "limit": 2} | ({"cursor": cursor} if cursor else {})
+        response = client.get(
+            "/items/search", params=params, headers=user_token_headers
+        )
+        assert response.status_code == 200
+        page = response.json()
+        found += [item["id"] for item in page["items"]]
+        if not (cursor := page["next_cursor"]):
+            break
+    assert sorted(found) == sorted(item_ids)
+
+    # visible to admins, but not to other users
+    response = client.get(
+        "/items/search", params={"q": f"searchable {word}"}, headers=admin_token_headers
+    )
+    assert len(response.json()["items"]) == 3
+    response = client.get(
+        "/items/search", params={"q": "-searchable"}, headers=user_token_headers
+    )
+    assert all(item["type"] != "searchable" for item in response.json()["items"])
+
+    for item_id in item_ids:
+        client.delete(f"/items/{item_id}", headers=user_token_headers)
+
+
+def test_item_stats(client: TestClient, user_token_headers: dict[str, str]) -> None:
+    item_type = f"stats-{uuid.uuid4().hex}"
+
+    def stats() -> list[dict]:
+        response = client.get(
+            "/items/stats", params={"type": item_type}, headers=user_token_headers
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    assert stats() == []
+    item_ids = []
+    for i in range(3):
+        item_in = {"type": item_type, "data": {"i": i}}
+        response = client.post("/items", json=item_in, headers=user_token_headers)
+        item_ids.append(response.json()["id"])
+        latest_create_date = response.json()["create_date"]
+    (row,) = stats()
+    assert row["count"] == 3
+    assert row["data_size"] == 3 * len('{"i": 0}')
+    assert row["latest_create_date"] == latest_create_date
+
+    client.delete(f"/items/{item_ids[-1]}", headers=user_token_headers)
+    (row,) = stats()
+    assert row["count"] == 2
+    assert row["latest_create_date"] < latest_create_date
+
+    for item_id in item_ids[:-1]:
+        client.delete(f"/items/{item_id}", headers=user_token_headers)
+    assert stats() == []
+
+
+def test_read_items_time_range(
+    client: TestClient, user_token_headers: dict[str, str]
+) -> None:
+    item_in = {"type": "time-range", "data": {}}
+    response = client.post("/items", json=item_in, headers=user_token_headers)
+    item = response.json()
+
+    def item_ids(**params) -> list[int]:
+        response = client.get(
+            "/items", params=params | {"limit": 1000}, headers=user_token_headers
+        )
+        assert response.status_code == 200
+        return [item["id"] for item in response.json()]
+
+    assert item["id"] in item_ids(since=item["create_date"])
+    assert item["id"] not in item_ids(until=item["create_date"])
+    assert item["id"] not in item_ids(
+        since="2000-01-01T00:00:00Z", until="2000-02-01T00:00:00Z"
+    )
+    client.delete(f"/items/{item['id']}", headers=user_token_headers)
+
+
+def test_msgpack_item(client: TestClient, user_token_headers: dict[str, str]) -> None:
+    item_in = {"type": "msgpack", "data": {"blob": "x" * 10000}}
+    headers = user_token_headers | {
+        "Content-Type": "application/msgpack",
+        "Accept": "application/msgpack",
+        "Accept-Encoding": "zstd",
+    }
+    response = client.post("/items", content=msgpack.packb(item_in), headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/msgpack"
+    assert response.headers["content-encoding"] == "zstd"
+    # the test client decodes the zstd content encoding
+    content = msgpack.unpackb(response.content)
+    assert content["data"] == item_in["data"]
+
+    response = client.get(f"/items/{content['id']}", headers=user_token_headers)
+    assert response.headers["content-type"] == "application/json"
+    assert response.json()["data"] == item_in["data"]
+    client.delete(f"/items/{content['id']}", headers=user_token_headers)
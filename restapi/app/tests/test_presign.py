@@ -0,0 +1,39 @@
+from fastapi.testclient import TestClient
+
+
+def test_presign(client: TestClient, user_token_headers: dict[str, str]) -> None:
+    batch = {
+        "objects": [
+            {"bucket": "user-test-readonly", "key": "a.root", "operation": "get"},
+            {"bucket": "user-test-readonly", "key": "b.root", "operation": "put"},
+        ]
+    }
+    response = client.post("/presign", json=batch)
+    assert response.status_code == 401
+    response = client.post("/presign", json=batch, headers=user_token_headers)
+    assert response.status_code == 200
+    content = response.json()
+    assert [out["key"] for out in content] == ["a.root", "b.root"]
+    for out in content:
+        assert "X-Amz-Signature=" in out["url"]
+        assert out["part_urls"] == []
+
+    batch["objects"].append(
+        {"bucket": "transfer-inbox", "key": "c.root", "operation": "get"}
+    )
+    response = client.post("/presign", json=batch, headers=user_token_headers)
+    assert response.status_code == 403
+
+    batch = {
+        "objects": [
+            {"bucket": "user-test-readonly", "key": "d", "operation": "multipart"}
+        ]
+    }
+    response = client.post("/presign", json=batch, headers=user_token_headers)
+    assert response.status_code == 422
+
+    # each of these has the maximum of 10000 parts
+    upload = {"bucket": "user-test-readonly", "operation": "multipart", "size": 10**13}
+    batch = {"objects": [upload | {"key": f"e{i}"} for i in range(11)]}
+    response = client.post("/presign", json=batch, headers=user_token_headers)
+    assert response.status_code == 422
@@ -0,0 +1,32 @@
+from fastapi.testclient import TestClient
+
+
+def test_profile_request(
+    client: TestClient,
+    admin_token_headers: dict[str, str],
+    user_token_headers: dict[str, str],
+) -> None:
+    # only administrators get a profile, others the usual response
+    response = client.get(
+        "/items/", params={"profile": "1"}, headers=user_token_headers
+    )
+    assert response.status_code == 200
+    assert isinstance(response.json(), list)
+
+    response = client.get(
+        "/items/", params={"profile": "1"}, headers=admin_token_headers
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    assert response.headers["x-profiled-status"] == "200"
+
+    response = client.get(
+        "/auth/profile", headers=admin_token_headers | {"X-Profile": "speedscope"}
+    )
+    assert response.status_code == 200
+    assert "speedscope" in response.json()["$schema"]
+
+    response = client.get("/profiles/", headers=user_token_headers)
+    assert response.status_code == 401
+    response = client.get("/profiles/", headers=admin_token_headers)
+    assert response.status_code == 200
@@ -0,0 +1,106 @@
+import datetime
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..db import Item, ItemStats, User, dbengine
+from ..retention import (
+    create_partitions,
+    expire_partition,
+    list_partitions,
+    purge_owner,
+)
+
+# A month long past, so that no other test has items in it
+OLD_MONTH = datetime.datetime(2001, 1, 15, tzinfo=datetime.timezone.utc)
+
+
+async def _add_owner() -> str:
+    owner_id = f"retention-{uuid.uuid4().hex}"
+    async with dbengine.begin() as conn:
+        await conn.execute(
+            pg_insert(User).values(
+                id=owner_id, username=owner_id, email="none", name="Retention Test"
+            )
+        )
+    return owner_id
+
+
+async def _add_items(owner_id: str, item_type: str, create_dates: list):
+    async with dbengine.begin() as conn:
+        await conn.execute(
+            insert(Item).values(
+                [
+                    {
+                        "owner_id": owner_id,
+                        "type": item_type,
+                        "data": {"n": i},
+                        "create_date": create_date,
+                    }
+                    for i, create_date in enumerate(create_dates)
+                ]
+            )
+        )
+
+
+async def _stats(owner_id: str) -> list[tuple[str, int]]:
+    async with dbengine.connect() as conn:
+        result = await conn.execute(
+            select(ItemStats.type, ItemStats.count).where(
+                ItemStats.owner_id == owner_id
+            )
+        )
+        return [tuple(row) for row in result]
+
+
+def test_create_partitions(client: TestClient) -> None:
+    async def create(months_ahead: int) -> list[str]:
+        async with dbengine.begin() as conn:
+            return await create_partitions(conn, months_ahead)
+
+    client.portal.call(create, 6)
+    assert client.portal.call(create, 6) == []
+
+    async def names() -> list[str]:
+        async with dbengine.connect() as conn:
+            return [name for name, _ in await list_partitions(conn)]
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    assert f"items_p{now:%Y%m}" in client.portal.call(names)
+
+
+def test_expire_partition(client: TestClient) -> None:
+    upper = datetime.datetime(2001, 2, 1, tzinfo=datetime.timezone.utc)
+
+    async def expire() -> list[tuple[str, int]]:
+        # items are only ever created at now(), this month needs a partition
+        async with dbengine.begin() as conn:
+            await conn.execute(select(func.create_item_partitions(OLD_MONTH, upper)))
+        owner_id = await _add_owner()
+        await _add_items(owner_id, "old", [OLD_MONTH] * 3)
+        await _add_items(owner_id, "mixed", [OLD_MONTH, func.now()])
+        assert sorted(await _stats(owner_id)) == [("mixed", 2), ("old", 3)]
+        async with dbengine.begin() as conn:
+            await expire_partition(conn, "items_p200101", upper, drop=True)
+        stats = await _stats(owner_id)
+        await purge_owner(owner_id, None, 100, 1000.0)
+        return stats
+
+    assert client.portal.call(expire) == [("mixed", 1)]
+
+
+def test_purge_owner(client: TestClient) -> None:
+    async def purge() -> tuple[int, list[tuple[str, int]]]:
+        owner_id = await _add_owner()
+        await _add_items(owner_id, "purged", [func.now()] * 5)
+        # three batches, the last one short
+        deleted = await purge_owner(owner_id, None, 2, 1000.0)
+        return deleted, await _stats(owner_id)
+
+    assert client.portal.call(purge) == (5, [])
+
+    with pytest.raises(ValueError):
+        client.portal.call(purge_owner, "nobody", None, 2, 0.0)
@@ -0,0 +1,89 @@
+"""A stand-in OpenID connect provider for benchmarks
+
+Serves a JWKS for a locally generated RSA key and signs tokens with it,
+so the restapi can be exercised without a Keycloak instance
+"""
+
+import datetime
+import socket
+import threading
+import time
+import uuid
+
+import uvicorn
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI
+from jose import jwk, jwt
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StubOIDCProvider:
+    def __init__(self, client_id: str, port: int | None = None):
+        self.client_id = client_id
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.kid = uuid.uuid4().hex
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._private_pem = private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+        public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        self._jwk = jwk.construct(public_pem, "RS256").to_dict() | {
+            "kid": self.kid,
+            "use": "sig",
+        }
+        self.app = FastAPI()
+        self.app.get("/.well-known/openid-configuration")(self.configuration)
+        self.app.get("/certs")(self.certs)
+        self._server: uvicorn.Server | None = None
+
+    def configuration(self):
+        return {"issuer": self.url, "jwks_uri": self.url + "/certs"}
+
+    def certs(self):
+        return {"keys": [self._jwk]}
+
+    def token(self, sub: str, username: str, scopes: list[str] = []) -> str:
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        claims = {
+            "exp": int((now + datetime.timedelta(hours=4)).timestamp()),
+            "iat": int(now.timestamp()),
+            "iss": self.url,
+            "aud": "account",
+            "sub": sub,
+            "typ": "Bearer",
+            "azp": self.client_id,
+            "scope": " ".join(["openid"] + scopes),
+            "email": f"{username}@example.com",
+            "name": username,
+            "preferred_username": username,
+            "given_name": username,
+            "family_name": "Benchmark",
+        }
+        return jwt.encode(
+            claims, self._private_pem, algorithm="RS256", headers={"kid": self.kid}
+        )
+
+    def start(self):
+        config = uvicorn.Config(
+            self.app, host="127.0.0.1", port=self.port, log_level="warning"
+        )
+        self._server = uvicorn.Server(config)
+        threading.Thread(target=self._server.run, daemon=True).start()
+        while not self._server.started:
+            time.sleep(0.01)
+
+    def stop(self):
+        if self._server:
+            self._server.should_exit = True
@@ -2,4 +2,5 @@
 set -e
 
 alembic upgrade head
+python -m app.retention maintain
 python -m app.init
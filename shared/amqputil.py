@@ -0,0 +1,140 @@
+import datetime
+import logging
+import os
+import uuid
+
+from aio_pika import DeliveryMode, Message
+from aio_pika.abc import AbstractChannel, AbstractMessage
+
+logger = logging.getLogger(__name__)
+
+ATTEMPT_HEADER = "x-attempt"
+ERROR_HEADER = "x-last-error"
+DEFAULT_RETRY_DELAYS = [10, 60, 600, 3600]
+
+
+def retry_delays() -> list[int]:
+    """Delays (in seconds) before each retry of a failed message
+
+    Configured as a comma-separated list in AMQP_RETRY_DELAYS. Once all
+    retries are used up the message is dead-lettered.
+    """
+    value = os.environ.get("AMQP_RETRY_DELAYS")
+    if value is None:
+        return DEFAULT_RETRY_DELAYS
+    return [int(delay) for delay in value.split(",") if delay]
+
+
+def retry_queue_name(queue_name: str, delay: int) -> str:
+    # The delay is part of the name since queue arguments cannot be changed
+    return f"{queue_name}.retry.{delay}s"
+
+
+def dead_letter_queue_name(queue_name: str) -> str:
+    return f"{queue_name}.dead"
+
+
+async def declare_retry_queues(
+    channel: AbstractChannel, exchange_name: str, queue_name: str, delays: list[int]
+):
+    """Declare delay queues and the dead-letter queue for queue_name
+
+    A delay queue holds each message for its TTL and then dead-letters it
+    back to the exchange with the routing key of the original queue
+    """
+    for delay in set(delays):
+        await channel.declare_queue(
+            retry_queue_name(queue_name, delay),
+            durable=True,
+            arguments={
+                "x-message-ttl": delay * 1000,
+                "x-dead-letter-exchange": exchange_name,
+                "x-dead-letter-routing-key": queue_name,
+            },
+        )
+    await channel.declare_queue(dead_letter_queue_name(queue_name), durable=True)
+
+
+def attempts(message: AbstractMessage) -> int:
+    return int(message.headers.get(ATTEMPT_HEADER) or 0)  # type: ignore[arg-type]
+
+
+def _republished(
+    message: AbstractMessage, attempt: int, error: str | None = None
+) -> Message:
+    headers = dict(message.headers)
+    headers[ATTEMPT_HEADER] = attempt
+    if error is None:
+        headers.pop(ERROR_HEADER, None)
+    else:
+        headers[ERROR_HEADER] = error
+    return Message(
+        message.body,
+        headers=headers,
+        content_type=message.content_type,
+        delivery_mode=DeliveryMode.PERSISTENT,
+        message_id=message.message_id or str(uuid.uuid4()),
+        timestamp=datetime.datetime.now(tz=datetime.timezone.utc),
+    )
+
+
+async def retry_or_dead_letter(
+    channel: AbstractChannel,
+    queue_name: str,
+    message: AbstractMessage,
+    error: str,
+    delays: list[int],
+) -> bool:
+    """Republish a failed message to the next delay queue, or dead-letter it
+
+    Returns True if the message will be retried
+    The caller is responsible for acknowledging the original message
+    """
+    attempt = attempts(message) + 1
+    if attempt <= len(delays):
+        delay = delays[attempt - 1]
+        routing_key = retry_queue_name(queue_name, delay)
+        logger.warning(f"Attempt {attempt} failed, retrying in {delay}s: {error}")
+    else:
+        routing_key = dead_letter_queue_name(queue_name)
+        logger.error(f"Attempt {attempt} failed, dead-lettering: {error}")
+    await channel.default_exchange.publish(
+        _republished(message, attempt, error), routing_key=routing_key
+    )
+    return routing_key != dead_letter_queue_name(queue_name)
+
+
+async def dead_letter(
+    channel: AbstractChannel, queue_name: str, message: AbstractMessage, error: str
+):
+    """Send a message straight to the dead-letter queue"""
+    await channel.default_exchange.publish(
+        _republished(message, attempts(message), error),
+        routing_key=dead_letter_queue_name(queue_name),
+    )
+
+
+async def replay(
+    channel: AbstractChannel,
+    exchange_name: str,
+    queue_name: str,
+    message: AbstractMessage,
+):
+    """Publish a dead-lettered message to its original queue, attempt count reset"""
+    exchange = await channel.get_exchange(exchange_name)
+    await exchange.publish(_republished(message, 0), routing_key=queue_name)
+
+
+async def forward(channel: AbstractChannel, queue_name: str, message: AbstractMessage):
+    """Publish a message as is (headers included) to another queue"""
+    await channel.default_exchange.publish(
+        Message(
+            message.body,
+            headers=dict(message.headers),
+            content_type=message.content_type,
+            delivery_mode=DeliveryMode.PERSISTENT,
+            message_id=message.message_id or str(uuid.uuid4()),
+            timestamp=message.timestamp,
+        ),
+        routing_key=queue_name,
+    )
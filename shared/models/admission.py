@@ -0,0 +1,23 @@
+from pydantic import BaseModel, Field
+
+
+class LimiterMetrics(BaseModel):
+    route_class: str
+    limit: int = Field(description="Requests handled concurrently")
+    queue_size: int = Field(description="Requests allowed to wait for a slot")
+    active: int
+    waiting: int
+    admitted: int
+    rejected: int
+
+
+class RateLimitMetrics(BaseModel):
+    rate: float = Field(description="Requests per second per subject (0 to disable)")
+    burst: int
+    subjects: int = Field(description="Subjects currently tracked")
+    rejected: int
+
+
+class AdmissionMetrics(BaseModel):
+    limiters: list[LimiterMetrics]
+    rate_limit: RateLimitMetrics
@@ -0,0 +1,40 @@
+import datetime
+from typing import Any, Literal
+
+from pydantic import BaseModel, ConfigDict, Field
+
+FileStatus = Literal["pending", "converting", "done", "failed"]
+
+
+class FileIn(BaseModel):
+    size: int
+    etag: str
+    status: FileStatus
+    keys: list[dict[str, Any]] | None = Field(
+        default=None, description="Key listing from the converter"
+    )
+
+
+class FileOut(BaseModel):
+    # attributes read from db.File
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    bucket: str
+    key: str
+    size: int
+    etag: str
+    status: FileStatus
+    keys: list[dict[str, Any]] | None
+    create_date: datetime.datetime
+    update_date: datetime.datetime
+
+
+class FileRef(BaseModel):
+    bucket: str
+    key: str
+    etag: str
+
+
+class FileLookupIn(BaseModel):
+    files: list[FileRef] = Field(max_length=1000)
@@ -0,0 +1,23 @@
+import datetime
+from typing import Any
+
+from pydantic import BaseModel, Field
+
+
+class DeadLetterOut(BaseModel):
+    message_id: str | None
+    attempts: int
+    error: str | None = Field(description="Error from the last attempt")
+    timestamp: datetime.datetime | None = Field(description="Time of dead-lettering")
+    event: Any = Field(description="Original notification body")
+
+
+class ReplayIn(BaseModel):
+    message_ids: list[str] | None = Field(
+        default=None, description="Messages to replay (all if not set)"
+    )
+    limit: int = Field(default=1000, ge=1, le=100000)
+
+
+class ReplayOut(BaseModel):
+    replayed: list[str]
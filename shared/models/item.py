@@ -1,15 +1,25 @@
 import datetime
 from typing import Any
 
-from pydantic import BaseModel, ConfigDict
-from pydantic.types import Json
+import pydantic_core
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 from .user import UserOut
 
 
 class ItemIn(BaseModel):
     type: str
-    data: Json[Any]
+    data: Any = Field(
+        description="Any JSON value. A string is parsed as JSON text, as was "
+        "required before native values were accepted"
+    )
+
+    @field_validator("data", mode="before")
+    @classmethod
+    def parse_json_text(cls, value: Any) -> Any:
+        if isinstance(value, (str, bytes)):
+            return pydantic_core.from_json(value)
+        return value
 
 
 class ItemOut(BaseModel):
@@ -21,3 +31,20 @@ class ItemOut(BaseModel):
     create_date: datetime.datetime
     type: str
     data: Any
+
+
+class ItemStreamSummary(BaseModel):
+    inserted: int = 0
+    failed: int = 0
+    errors: list[str] = Field(default=[], description="The first few errors")
+
+
+class ItemStatsOut(BaseModel):
+    # attributes read from db.ItemStats
+    model_config = ConfigDict(from_attributes=True)
+
+    owner_id: str
+    type: str
+    count: int
+    data_size: int = Field(description="Total size of data in bytes, as JSON text")
+    latest_create_date: datetime.datetime
@@ -0,0 +1,61 @@
+import math
+from typing import Literal
+
+from pydantic import BaseModel, Field, model_validator
+
+from ..s3util import multipart_part_size
+
+MAX_PRESIGN_BATCH = 10000
+# Part URLs signed for one batch, each is signed in the request and adds about
+# half a kilobyte to the response
+MAX_PRESIGN_PARTS = 100000
+
+
+class PresignRequest(BaseModel):
+    bucket: str
+    key: str
+    operation: Literal["get", "put", "multipart"]
+    size: int | None = Field(
+        default=None, ge=0, description="Object size in bytes (multipart only)"
+    )
+
+    @model_validator(mode="after")
+    def check_size(self) -> "PresignRequest":
+        if self.operation == "multipart" and self.size is None:
+            raise ValueError("size is required for multipart operations")
+        return self
+
+    @property
+    def parts(self) -> int:
+        """Number of part URLs to sign, as in s3util.presign_multipart_upload"""
+        if self.operation != "multipart" or self.size is None:
+            return 0
+        return max(1, math.ceil(self.size / multipart_part_size(self.size)))
+
+
+class PresignBatchIn(BaseModel):
+    objects: list[PresignRequest] = Field(max_length=MAX_PRESIGN_BATCH)
+    expires_in: int = Field(default=3600, ge=1, le=7 * 24 * 3600)
+
+    @model_validator(mode="after")
+    def check_parts(self) -> "PresignBatchIn":
+        parts = sum(request.parts for request in self.objects)
+        if parts > MAX_PRESIGN_PARTS:
+            raise ValueError(
+                f"Batch would sign {parts} parts, more than {MAX_PRESIGN_PARTS}"
+            )
+        return self
+
+
+class PresignOut(BaseModel):
+    bucket: str
+    key: str
+    operation: Literal["get", "put", "multipart"]
+    url: str | None = Field(default=None, description="GET/PUT URL")
+    upload_id: str | None = None
+    part_size: int | None = None
+    part_urls: list[str] = Field(
+        default=[], description="Upload URL for part number i + 1"
+    )
+    complete_url: str | None = None
+    abort_url: str | None = None
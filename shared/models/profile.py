@@ -0,0 +1,12 @@
+import datetime
+
+from pydantic import BaseModel, Field
+
+
+class ProfileOut(BaseModel):
+    id: str
+    method: str
+    path: str
+    status_code: int | None
+    duration: float = Field(description="Request wall time in seconds")
+    time: datetime.datetime
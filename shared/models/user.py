@@ -13,3 +13,6 @@ class UserOut(BaseModel):
 
 class CurrentUser(UserOut):
     scopes: list[str] = []
+    bucket: str | None = Field(
+        default=None, description="Personal bucket, also the name of its role"
+    )
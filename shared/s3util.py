@@ -1,7 +1,12 @@
+import asyncio
+import dataclasses
 import json
 import logging
+import math
 import os
-from typing import TYPE_CHECKING, Literal, overload
+import re
+import urllib.parse
+from typing import TYPE_CHECKING, AsyncIterable, AsyncIterator, Literal, overload
 
 if TYPE_CHECKING:
     from types_aiobotocore_iam.client import IAMClient
@@ -11,6 +16,8 @@ if TYPE_CHECKING:
     from types_aiobotocore_sns.client import SNSClient
     from types_aiobotocore_sts.client import STSClient
 
+import aiohttp
+from aiobotocore.config import AioConfig
 from aiobotocore.session import get_session
 from botocore.exceptions import ClientError
 
@@ -20,24 +27,244 @@ logger = logging.getLogger(__name__)
 RGW_TOPIC_PREFIX = "arn:aws:sns:default::"
 RGW_OIDCPROVIDER_PREFIX = "arn:aws:iam:::oidc-provider/"
 
+# Personal buckets and their roles are named with this prefix, so that no
+# username can name a system bucket or role
+PERSONAL_BUCKET_PREFIX = os.environ.get("PERSONAL_BUCKET_PREFIX", "user-")
+# DNS-compatible bucket names, without dots
+BUCKET_NAME = re.compile(r"[a-z0-9][a-z0-9-]{1,61}[a-z0-9]")
+# Tag recording whom a bucket was created for
+OWNER_TAG = "provisioned-for"
+
 
 @overload
-def get_client(service: Literal["s3"]) -> "S3Client": ...
+def get_client(
+    service: Literal["s3"], endpoint_url: str | None = None
+) -> "S3Client": ...
 @overload
-def get_client(service: Literal["sns"]) -> "SNSClient": ...
+def get_client(
+    service: Literal["sns"], endpoint_url: str | None = None
+) -> "SNSClient": ...
 @overload
-def get_client(service: Literal["sts"]) -> "STSClient": ...
+def get_client(
+    service: Literal["sts"], endpoint_url: str | None = None
+) -> "STSClient": ...
 @overload
-def get_client(service: Literal["iam"]) -> "IAMClient": ...
-def get_client(service):
+def get_client(
+    service: Literal["iam"], endpoint_url: str | None = None
+) -> "IAMClient": ...
+def get_client(service, endpoint_url=None):
+    """Create a client for one of the S3 endpoint services
+
+    endpoint_url overrides S3_ENDPOINT, e.g. to sign URLs against the
+    externally reachable name of the endpoint
+    """
     session = get_session()
     return session.create_client(
         service,
         region_name="default",
-        endpoint_url=os.environ["S3_ENDPOINT"],
+        endpoint_url=endpoint_url or os.environ["S3_ENDPOINT"],
         aws_access_key_id=os.environ["S3_ACCESS_KEY"],
         aws_secret_access_key=os.environ["S3_SECRET_KEY"],
+        # presigned URLs should use SigV4 regardless of the endpoint default
+        config=AioConfig(signature_version="s3v4") if service == "s3" else None,
+    )
+
+
+PresignOperation = Literal["get", "put"]
+
+
+async def presign_object(
+    client: "S3Client",
+    bucket: str,
+    key: str,
+    operation: PresignOperation,
+    expires_in: int = 3600,
+) -> str:
+    """Generate a presigned GET or PUT URL for an object
+
+    The signature is computed locally, no request is made to the endpoint
+    """
+    client_method = {"get": "get_object", "put": "put_object"}[operation]
+    return await client.generate_presigned_url(
+        client_method,
+        Params={"Bucket": bucket, "Key": key},
+        ExpiresIn=expires_in,
+    )
+
+
+MULTIPART_MIN_PART_SIZE = 8 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10000
+# S3 rejects smaller parts, except the last
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def multipart_part_size(size: int, part_size: int = MULTIPART_MIN_PART_SIZE) -> int:
+    """Smallest part size >= part_size that covers size in at most 10k parts"""
+    return max(part_size, math.ceil(size / MULTIPART_MAX_PARTS))
+
+
+@dataclasses.dataclass
+class PresignedMultipartUpload:
+    upload_id: str
+    part_size: int
+    part_urls: list[str]
+    complete_url: str
+    abort_url: str
+
+
+async def presign_multipart_upload(
+    client: "S3Client",
+    bucket: str,
+    key: str,
+    size: int,
+    expires_in: int = 3600,
+    part_size: int = MULTIPART_MIN_PART_SIZE,
+    signer: "S3Client | None" = None,
+) -> PresignedMultipartUpload:
+    """Start a multipart upload and presign URLs for all of its parts
+
+    This makes one request to the endpoint (to obtain the upload ID),
+    all the part, complete, and abort URLs are signed locally, by signer
+    if given, e.g. a client for the externally visible endpoint.
+    The client uploads part i (1-based) of part_size bytes to part_urls[i - 1]
+    and then POSTs the CompleteMultipartUpload document to complete_url
+    """
+    signer = signer or client
+    part_size = multipart_part_size(size, part_size)
+    nparts = max(1, math.ceil(size / part_size))
+    response = await client.create_multipart_upload(Bucket=bucket, Key=key)
+    upload_id = response["UploadId"]
+    params = {"Bucket": bucket, "Key": key, "UploadId": upload_id}
+    part_urls = [
+        await signer.generate_presigned_url(
+            "upload_part",
+            Params=params | {"PartNumber": part_number},
+            ExpiresIn=expires_in,
+        )
+        for part_number in range(1, nparts + 1)
+    ]
+    complete_url = await signer.generate_presigned_url(
+        "complete_multipart_upload", Params=params, ExpiresIn=expires_in
     )
+    abort_url = await signer.generate_presigned_url(
+        "abort_multipart_upload", Params=params, ExpiresIn=expires_in
+    )
+    return PresignedMultipartUpload(
+        upload_id, part_size, part_urls, complete_url, abort_url
+    )
+
+
+async def _iter_parts(
+    source: str | AsyncIterable[bytes], part_size: int
+) -> AsyncIterator[bytes]:
+    """Re-chunk a file or byte stream into parts of part_size (the last may be short)"""
+    if isinstance(source, str):
+        with open(source, "rb") as fin:
+            while part := await asyncio.to_thread(fin.read, part_size):
+                yield part
+        return
+    buffer = bytearray()
+    async for chunk in source:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _upload_part(
+    client: "S3Client",
+    params: dict,
+    part_number: int,
+    body: bytes,
+    retries: int,
+) -> str:
+    for attempt in range(retries + 1):
+        try:
+            response = await client.upload_part(
+                **params, PartNumber=part_number, Body=body
+            )
+            return response["ETag"]
+        except (ClientError, aiohttp.ClientError, asyncio.TimeoutError) as ex:
+            if attempt == retries:
+                raise
+            delay = 2**attempt
+            logger.warning(f"Part {part_number} failed ({ex}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+async def upload_multipart(
+    client: "S3Client",
+    bucket: str,
+    key: str,
+    source: str | AsyncIterable[bytes],
+    part_size: int = 64 * 1024 * 1024,
+    max_in_flight: int = 256 * 1024 * 1024,
+    retries: int = 3,
+) -> str:
+    """Upload a file (by path) or an async byte stream, with parts in parallel
+
+    At most max_in_flight bytes of parts are held in memory at once, each
+    part is retried up to retries times, and on failure the multipart upload
+    is aborted so no orphaned parts are left behind.
+    Objects that fit in one part are uploaded with a single PUT.
+
+    Returns the ETag of the object
+    """
+    if part_size < S3_MIN_PART_SIZE:
+        raise ValueError(f"part_size {part_size} is below the S3 minimum")
+    parts = _iter_parts(source, part_size)
+    first = await anext(parts, None)
+    second = await anext(parts, None) if first is not None else None
+    if second is None:
+        response = await client.put_object(Bucket=bucket, Key=key, Body=first or b"")
+        return response["ETag"]
+
+    response = await client.create_multipart_upload(Bucket=bucket, Key=key)
+    params = {"Bucket": bucket, "Key": key, "UploadId": response["UploadId"]}
+    # the first two parts are already read and hold two of the slots
+    slots = asyncio.Semaphore(max(2, max_in_flight // part_size) - 2)
+
+    async def upload(part_number: int, body: bytes) -> str:
+        try:
+            return await _upload_part(client, params, part_number, body, retries)
+        finally:
+            slots.release()
+
+    tasks: list[asyncio.Task[str]] = []
+    try:
+        part_number = 0
+        body: bytes | None = first
+        while body is not None:
+            part_number += 1
+            tasks.append(asyncio.create_task(upload(part_number, body)))
+            if any(task.done() and task.exception() for task in tasks):
+                break
+            if part_number == 1:
+                body = second
+            else:
+                # wait for a slot before reading further, bounding memory use
+                await slots.acquire()
+                body = await anext(parts, None)
+        etags = await asyncio.gather(*tasks)
+        response = await client.complete_multipart_upload(
+            **params,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": i + 1, "ETag": etag} for i, etag in enumerate(etags)
+                ]
+            },
+        )
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.error(f"Aborting multipart upload of {bucket}/{key}")
+        await client.abort_multipart_upload(**params)
+        raise
+    return response["ETag"]
 
 
 async def create_bucket(
@@ -66,6 +293,45 @@ async def create_bucket(
         raise
 
 
+def personal_bucket_name(username: str) -> str | None:
+    """Name of the personal bucket (and role) of username, None if it has none
+
+    Characters not allowed in bucket names become '-'; usernames that still
+    do not make a valid bucket name get no personal bucket
+    """
+    name = PERSONAL_BUCKET_PREFIX + re.sub(r"[^a-z0-9-]", "-", username.lower())
+    return name if BUCKET_NAME.fullmatch(name) else None
+
+
+async def create_owned_bucket(client: "S3Client", bucket_name: str, owner: str) -> str:
+    """Create a bucket for owner, tagged as such, or check an existing one is
+
+    Raises RuntimeError if the bucket exists but was not created for owner
+
+    Returns bucket name on success
+    """
+    try:
+        await client.create_bucket(Bucket=bucket_name)
+    except ClientError as ex:
+        if _error_code(ex) != "BucketAlreadyOwnedByYou":
+            raise
+        try:
+            response = await client.get_bucket_tagging(Bucket=bucket_name)
+            tags = {tag["Key"]: tag["Value"] for tag in response["TagSet"]}
+        except ClientError as ex:
+            if _error_code(ex) != "NoSuchTagSet":
+                raise
+            tags = {}
+        if tags.get(OWNER_TAG) != owner:
+            raise RuntimeError(f"Bucket {bucket_name} was not created for {owner}")
+        return bucket_name
+    await client.put_bucket_tagging(
+        Bucket=bucket_name, Tagging={"TagSet": [{"Key": OWNER_TAG, "Value": owner}]}
+    )
+    logger.info(f"Bucket {bucket_name} created for {owner}")
+    return bucket_name
+
+
 PolicyType = Literal["read-write", "all"]
 
 
@@ -97,7 +363,13 @@ async def set_bucket_policy(
      - a role ARN, e.g. "arn:aws:iam:::role/oidcuser"
     policy type is read-write, read, etc.
     """
-    policy = {
+    policy_document = _policy_document(bucket_policy(bucket, policy_map))
+    await client.put_bucket_policy(Bucket=bucket, Policy=policy_document)
+
+
+def bucket_policy(bucket: str, policy_map: dict[str, PolicyType]) -> dict:
+    """The policy document set_bucket_policy() sets"""
+    return {
         "Version": "2012-10-17",
         "Statement": [
             {
@@ -112,8 +384,39 @@ async def set_bucket_policy(
             for principal, policy_type in policy_map.items()
         ],
     }
-    policy_document = json.dumps(policy, separators=(",", ":"))
-    await client.put_bucket_policy(Bucket=bucket, Policy=policy_document)
+
+
+def normalize_policy(policy: dict) -> dict:
+    """Policy in a canonical form, for comparison
+
+    Servers return policies with single values unwrapped from lists and with
+    lists reordered, which is insignificant
+    """
+
+    def normalize(value, key: str | None = None):
+        if isinstance(value, dict):
+            return {k: normalize(v, k) for k, v in value.items()}
+        # a single value is equivalent to a list of one, except in these
+        if isinstance(value, str) and key not in (None, "Effect", "Sid"):
+            value = [value]
+        if isinstance(value, list):
+            return sorted((normalize(v) for v in value), key=json.dumps)
+        return value
+
+    statements = policy.get("Statement", [])
+    return {
+        "Version": policy.get("Version"),
+        "Statement": normalize(
+            statements if isinstance(statements, list) else [statements]
+        ),
+    }
+
+
+def oidc_provider_arn_for(oidc_provider_url: str) -> str:
+    """ARN of the OpenID connect provider registered for oidc_provider_url"""
+    if oidc_provider_url.startswith("https://"):
+        return RGW_OIDCPROVIDER_PREFIX + oidc_provider_url.removeprefix("https://")
+    raise ValueError(f"Malformed OpenID connect provider URL: {oidc_provider_url}")
 
 
 async def register_oidc_provider(
@@ -134,12 +437,7 @@ async def register_oidc_provider(
     """
     from . import jwtutil
 
-    if oidc_provider_url.startswith("https://"):
-        oidc_provider_arn = RGW_OIDCPROVIDER_PREFIX + oidc_provider_url.removeprefix(
-            "https://"
-        )
-    else:
-        raise ValueError(f"Malformed OpenID connect provider URL: {oidc_provider_url}")
+    oidc_provider_arn = oidc_provider_arn_for(oidc_provider_url)
     providers = [
         provider["Arn"]
         for provider in (await client.list_open_id_connect_providers())[
@@ -172,17 +470,16 @@ async def register_oidc_provider(
     return oidc_provider_arn
 
 
-async def create_oidc_role(
-    client: "IAMClient", oidc_provider_arn: str, username: str, oidc_subject: str
-):
-    """Create a new role for use with S3
+def _error_code(ex: ClientError) -> str:
+    if "Error" in ex.response:
+        return ex.response["Error"]["Code"]
+    # RadosGW does not conform to schema
+    return ex.response["Code"]  # type: ignore[typeddict-item]
 
-    oidc_provider_arn is as returned by a call to register_oidc_provider()
-    username will be the internal S3 user/role name
-    oidc_subject must match the 'sub' field of a JWT used to assume the role using the STS client
-    """
+
+def _assume_role_policy(oidc_provider_arn: str, oidc_subject: str) -> dict:
     provider_attr_prefix = oidc_provider_arn.removeprefix(RGW_OIDCPROVIDER_PREFIX)
-    policy = {
+    return {
         "Version": "2012-10-17",
         "Statement": [
             {
@@ -197,10 +494,50 @@ async def create_oidc_role(
             }
         ],
     }
-    policy_document = json.dumps(policy, separators=(",", ":"))
+
+
+def _role_policy(username: str) -> dict:
+    # TODO: customize policy (for now just grant all on personal bucket)
+    return {
+        "Version": "2012-10-17",
+        "Statement": {
+            "Effect": "Allow",
+            "Action": "s3:*",
+            "Resource": f"arn:aws:s3:::{username}/*",
+        },
+    }
+
+
+def _role_policy_name(username: str) -> str:
+    return f"RolePolicy_{username}"
+
+
+def _policy_document(policy: dict) -> str:
+    return json.dumps(policy, separators=(",", ":"))
+
+
+def _parse_policy_document(document: str | dict) -> dict:
+    # AWS returns URL-encoded documents, RadosGW plain JSON
+    if isinstance(document, dict):
+        return document
+    return json.loads(urllib.parse.unquote(document))
+
+
+async def create_oidc_role(
+    client: "IAMClient", oidc_provider_arn: str, username: str, oidc_subject: str
+):
+    """Create a new role for use with S3
+
+    oidc_provider_arn is as returned by a call to register_oidc_provider()
+    username will be the internal S3 user/role name
+    oidc_subject must match the 'sub' field of a JWT used to assume the role using the STS client
+    An existing role is only updated if it trusts the same subject, otherwise
+    RuntimeError is raised
+    """
+    trust_policy = _assume_role_policy(oidc_provider_arn, oidc_subject)
     try:
         response = await client.create_role(
-            AssumeRolePolicyDocument=policy_document,
+            AssumeRolePolicyDocument=_policy_document(trust_policy),
             RoleName=username,
         )
         if response["Role"]["RoleName"] != username:
@@ -208,36 +545,137 @@ async def create_oidc_role(
                 f"Tried to create a role {username} but got {response['Role']['RoleName']}!"
             )
     except ClientError as ex:
-        if "Error" in ex.response:
-            code = ex.response["Error"]["Code"]
-        else:
-            # RadosGW does not conform to schema
-            code = ex.response["Code"]  # type: ignore[typeddict-item]
-        if code != "EntityAlreadyExists":
+        if _error_code(ex) != "EntityAlreadyExists":
             raise
-    # update instead
-    await client.update_assume_role_policy(
-        RoleName=username,
-        PolicyDocument=policy_document,
-    )
-    # TODO: customize policy (for now just grant all on personal bucket)
-    role_policy = {
-        "Version": "2012-10-17",
-        "Statement": {
-            "Effect": "Allow",
-            "Action": "s3:*",
-            "Resource": f"arn:aws:s3:::{username}/*",
-        },
-    }
-    policy_document = json.dumps(role_policy, separators=(",", ":"))
+        # never hand over another principal's role
+        response = await client.get_role(RoleName=username)
+        current_trust_policy = _parse_policy_document(
+            response["Role"]["AssumeRolePolicyDocument"]
+        )
+        if normalize_policy(current_trust_policy) != normalize_policy(trust_policy):
+            raise RuntimeError(f"Role {username} is trusted by another principal")
     await client.put_role_policy(
         RoleName=username,
-        PolicyName=f"RolePolicy_{username}",
-        PolicyDocument=policy_document,
+        PolicyName=_role_policy_name(username),
+        PolicyDocument=_policy_document(_role_policy(username)),
     )
     return username
 
 
+@dataclasses.dataclass
+class RoleReconcileSummary:
+    created: list[str] = dataclasses.field(default_factory=list)
+    updated: list[str] = dataclasses.field(default_factory=list)
+    unchanged: list[str] = dataclasses.field(default_factory=list)
+    failed: dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+async def _reconcile_oidc_role(
+    client: "IAMClient",
+    oidc_provider_arn: str,
+    username: str,
+    oidc_subject: str,
+    existing_role: dict | None,
+) -> Literal["created", "updated", "unchanged"]:
+    trust_policy = _assume_role_policy(oidc_provider_arn, oidc_subject)
+    role_policy = _role_policy(username)
+    policy_name = _role_policy_name(username)
+    if existing_role is None:
+        await client.create_role(
+            AssumeRolePolicyDocument=_policy_document(trust_policy),
+            RoleName=username,
+        )
+        await client.put_role_policy(
+            RoleName=username,
+            PolicyName=policy_name,
+            PolicyDocument=_policy_document(role_policy),
+        )
+        return "created"
+
+    if "AssumeRolePolicyDocument" not in existing_role:
+        existing_role = (await client.get_role(RoleName=username))["Role"]
+    current_trust_policy = _parse_policy_document(
+        existing_role["AssumeRolePolicyDocument"]
+    )
+    try:
+        response = await client.get_role_policy(
+            RoleName=username, PolicyName=policy_name
+        )
+        current_role_policy = _parse_policy_document(response["PolicyDocument"])
+    except ClientError as ex:
+        if _error_code(ex) != "NoSuchEntity":
+            raise
+        current_role_policy = None
+
+    changed = False
+    if normalize_policy(current_trust_policy) != normalize_policy(trust_policy):
+        await client.update_assume_role_policy(
+            RoleName=username,
+            PolicyDocument=_policy_document(trust_policy),
+        )
+        changed = True
+    if current_role_policy is None or (
+        normalize_policy(current_role_policy) != normalize_policy(role_policy)
+    ):
+        await client.put_role_policy(
+            RoleName=username,
+            PolicyName=policy_name,
+            PolicyDocument=_policy_document(role_policy),
+        )
+        changed = True
+    return "updated" if changed else "unchanged"
+
+
+async def reconcile_oidc_roles(
+    client: "IAMClient",
+    oidc_provider_arn: str,
+    roles: list[tuple[str, str]],
+    max_concurrency: int = 16,
+) -> RoleReconcileSummary:
+    """Bring a set of OIDC roles (as made by create_oidc_role) up to date
+
+    roles is a list of (username, oidc_subject) pairs
+    Existing roles are listed once, then each role is compared with its desired
+    trust and role policy and only the differing parts are written.
+    At most max_concurrency roles are processed at once.
+    Roles not in the list are left alone.
+    """
+    existing: dict[str, dict] = {}
+    paginator = client.get_paginator("list_roles")
+    async for page in paginator.paginate():
+        for role in page["Roles"]:
+            existing[role["RoleName"]] = dict(role)
+    logger.info(f"Found {len(existing)} existing roles")
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    summary = RoleReconcileSummary()
+
+    async def reconcile(username: str, oidc_subject: str):
+        async with semaphore:
+            try:
+                result = await _reconcile_oidc_role(
+                    client,
+                    oidc_provider_arn,
+                    username,
+                    oidc_subject,
+                    existing.get(username),
+                )
+            except ClientError as ex:
+                logger.error(f"Failed to reconcile role {username}: {ex}")
+                summary.failed[username] = str(ex)
+                return
+        getattr(summary, result).append(username)
+
+    await asyncio.gather(
+        *(reconcile(username, oidc_subject) for username, oidc_subject in roles)
+    )
+    logger.info(
+        f"Roles created: {len(summary.created)}, updated: {len(summary.updated)}, "
+        f"unchanged: {len(summary.unchanged)}, failed: {len(summary.failed)}"
+    )
+    return summary
+
+
 async def register_notification_topic(
     client: "SNSClient", queue_name: str, purge: bool = False
 ) -> str:
@@ -266,3 +704,36 @@ async def register_notification_topic(
     except ClientError as ex:
         logger.error(ex.response["Error"])
     return topic_arn
+
+
+async def register_notification_topics(
+    client: "SNSClient", queue_names: list[str]
+) -> dict[str, str]:
+    """Register several notification topics, creating only the missing ones
+
+    Existing topics are listed once and missing ones are created concurrently
+
+    Returns a map of queue name to topic ARN
+    """
+    topic_arns = {name: RGW_TOPIC_PREFIX + name for name in queue_names}
+    existing = {topic["TopicArn"] for topic in (await client.list_topics())["Topics"]}
+
+    async def create(queue_name: str):
+        response = await client.create_topic(
+            Name=queue_name,
+            Attributes={
+                "push-endpoint": os.environ["AMQP_URL"],
+                "persistent": "true",
+                "amqp-exchange": os.environ["AMQP_EXCHANGE"],
+            },
+        )
+        if response["TopicArn"] != topic_arns[queue_name]:
+            raise RuntimeError(
+                f"Tried to create topic {topic_arns[queue_name]} but ended up with {response['TopicArn']}!"
+            )
+        logger.info(f"Created topic: {response['TopicArn']}")
+
+    await asyncio.gather(
+        *(create(name) for name, arn in topic_arns.items() if arn not in existing)
+    )
+    return topic_arns